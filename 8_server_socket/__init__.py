@@ -30,6 +30,7 @@ import json
 import sys
 import getpath
 import os
+import threading
 
 mhapi = gui3d.app.mhapi
 isPy3 = mhapi.utility.isPy3
@@ -38,7 +39,17 @@ if isPy3:
     from .dirops import SocketDirOps
     from .meshops import SocketMeshOps
     from .modops import SocketModifierOps
+    from .batchops import SocketBatchOps
+    from .sharedmem import SharedArrayStore
+    from .jsonencoder import JsonEncoder
+    from .humanstate import HumanState, STATE_PROXIES
+    from .resultcache import ResultCache
+    from .serverops import SocketServerOps
     from .workerthread import WorkerThread
+    from .asyncserver import AsyncServerThread
+    from .dispatcher import RequestDispatcher
+    from .abstractop import PRIORITY_INTERACTIVE
+    from . import protocol
 
 class SocketTaskView(gui3d.TaskView):
 
@@ -50,15 +61,38 @@ class SocketTaskView(gui3d.TaskView):
         self.socketConfig = {'acceptConnections': False,
                              'advanced': False,
                              'host': '127.0.0.1',
-                             'port': 12345 }
+                             'port': 12345,
+                             'tcp': True,
+                             'unixSocketPath': '',
+                             'keepAliveTimeout': 30,
+                             'threadPoolSize': 4,
+                             'maxQueueDepth': 32,
+                             'engine': 'thread',
+                             'readTimeout': 30,
+                             'writeTimeout': 30,
+                             'maxRequestSize': 64 * 1024 * 1024,
+                             'compressionThreshold': 16 * 1024,
+                             'resultCacheSize': 64 * 1024 * 1024 }
 
         if socketConfig and isinstance(socketConfig, dict):
             self.socketConfig['acceptConnections'] = socketConfig.get('acceptConnections', False)
             self.socketConfig['advanced'] = socketConfig.get('advanced', False)
             self.socketConfig['host'] = socketConfig.get('host', '127.0.0.1')
             self.socketConfig['port'] = socketConfig.get('port', 12345)
+            self.socketConfig['tcp'] = socketConfig.get('tcp', True)
+            self.socketConfig['unixSocketPath'] = socketConfig.get('unixSocketPath', '')
+            self.socketConfig['keepAliveTimeout'] = socketConfig.get('keepAliveTimeout', 30)
+            self.socketConfig['threadPoolSize'] = socketConfig.get('threadPoolSize', 4)
+            self.socketConfig['maxQueueDepth'] = socketConfig.get('maxQueueDepth', 32)
+            self.socketConfig['engine'] = socketConfig.get('engine', 'thread')
+            self.socketConfig['readTimeout'] = socketConfig.get('readTimeout', 30)
+            self.socketConfig['writeTimeout'] = socketConfig.get('writeTimeout', 30)
+            self.socketConfig['maxRequestSize'] = socketConfig.get('maxRequestSize', 64 * 1024 * 1024)
+            self.socketConfig['compressionThreshold'] = socketConfig.get('compressionThreshold', 16 * 1024)
+            self.socketConfig['resultCacheSize'] = socketConfig.get('resultCacheSize', 64 * 1024 * 1024)
 
         self.workerthread = None
+        self.dispatcher = None
 
         self.log = mhapi.utility.getLogChannel("socket")
 
@@ -110,9 +144,15 @@ class SocketTaskView(gui3d.TaskView):
         self.scriptText.setLineWrapMode(gui.DocumentEdit.NoWrap)
 
         if isPy3:
+            self.sharedArrays = SharedArrayStore()
+            self.jsonEncoder = JsonEncoder()
+            self.humanState = HumanState()
+            self.resultCache = ResultCache(self.socketConfig.get('resultCacheSize'))
             self.dirops = SocketDirOps(self)
             self.meshops = SocketMeshOps(self)
             self.modops = SocketModifierOps(self)
+            self.batchops = SocketBatchOps(self)
+            self.serverops = SocketServerOps(self)
             if self.socketConfig.get('acceptConnections'):
                 self.accToggleButton.setChecked(True)
                 self.openSocket()
@@ -146,51 +186,190 @@ class SocketTaskView(gui3d.TaskView):
             self.spacer.hide()
             self.changeAddrButton.hide()
 
+    def onHumanChanged(self, event):
+        if isPy3:
+            changed = self.humanState.onHumanChanged(event)
+            self.resultCache.invalidate(changed)
+            if STATE_PROXIES in changed:
+                self.meshops.invalidateProxyIndex()
+            self.meshops.poseCache.onHumanChanged(event)
+
     def threadMessage(self,message):
         self.addMessage(str(message))
 
-    def evaluateCall(self):
-        ops = None
-        data = self.workerthread.jsonCall
-        conn = self.workerthread.currentConnection
-
-        if self.meshops.hasOp(data.function):
-            ops = self.meshops
-
-        if self.dirops.hasOp(data.function):
-            ops = self.dirops
-
-        if self.modops.hasOp(data.function):
-            ops = self.modops
+    def _getOps(self, function):
+        for ops in (self.meshops, self.dirops, self.modops, self.batchops, self.serverops):
+            if ops.hasOp(function):
+                return ops
+        return None
+
+    def isThreadSafeCall(self, jsonCall):
+        """True if jsonCall may be evaluated outside the GUI thread."""
+        ops = self._getOps(jsonCall.function)
+        return ops is not None and ops.isThreadSafe(jsonCall.function, jsonCall)
+
+    def getCallPriority(self, jsonCall):
+        ops = self._getOps(jsonCall.function)
+        if ops is None:
+            return PRIORITY_INTERACTIVE
+        return ops.getPriority(jsonCall.function)
+
+    def evaluateOps(self, ops, conn, jsonCall):
+        """Evaluate jsonCall with ops. If the function reports an etag, it is
+        set as the "etag" param, and the call is skipped if the client's
+        "ifNoneMatch" param already matches it. Results of cached functions
+        are taken from the result cache when possible."""
+        dependencies = ops.getDependencies(jsonCall.function, jsonCall)
+        if dependencies:
+            # Taken before evaluating, so a change during the call leads to a
+            # new fetch next time rather than to a stale result being kept.
+            etag = self.humanState.getVersion(dependencies)
+            jsonCall.setParam(protocol.ETAG_PARAM, etag)
+            ifNoneMatch = jsonCall.getParam(protocol.IF_NONE_MATCH_PARAM)
+            if ifNoneMatch is not None:
+                try:
+                    notModified = int(ifNoneMatch) == etag
+                except (TypeError, ValueError):
+                    notModified = False
+                jsonCall.setParam(protocol.NOT_MODIFIED_PARAM, notModified)
+                if notModified:
+                    jsonCall.responseIsBinary = False
+                    jsonCall.data = None
+                    return jsonCall
+            # Shared memory responses only point at a segment that the next
+            # call overwrites, so they can not be reused
+            if ops.isCached(jsonCall.function) and not jsonCall.getParam("sharedMemory"):
+                key = self.resultCache.makeKey(jsonCall)
+                result = self.resultCache.get(key)
+                if result is not None:
+                    jsonCall.responseIsBinary, jsonCall.data = result
+                    return jsonCall
+                ops.evaluateOp(conn, jsonCall)
+                if not jsonCall.getError():
+                    self.resultCache.put(key, dependencies, jsonCall, self.jsonEncoder)
+                return jsonCall
+        return ops.evaluateOp(conn, jsonCall)
+
+    def evaluateCall(self, conn, data):
+        """Evaluate a call and prepare its response. Runs on the GUI thread,
+        or on a pool thread for thread-safe calls, while the caller holds
+        the state lock. Nothing is sent here, since sending waits for the
+        client: the caller passes the returned response to sendResponse
+        once it has released the lock. Streaming calls return None and are
+        sent with sendStream instead."""
+        ops = self._getOps(data.function)
 
         if ops:
-            jsonCall = ops.evaluateOp(conn,data)
+            jsonCall = self.evaluateOps(ops, conn, data)
         else:
             jsonCall = data
             jsonCall.error = "Unknown command"
 
-        if not jsonCall.responseIsBinary:
-            self.addMessage("About to serialize JSON. This might take some time.")
-            response = jsonCall.serialize()
-            #print("About to send:\n\n" + response)
-            response = bytes(response, encoding='utf-8')
-        else:
-            response = jsonCall.data
-            #print("About to send binary response with length " + str(len(response)))
+        if getattr(jsonCall, "stream", None) is not None:
+            if not jsonCall.getError():
+                return None
+            jsonCall.stream = None
+        return self.prepareResponse(jsonCall)
+
+    def encodeJson(self, jsonCall):
+        """Encode jsonCall as JSON and return the list of encoded chunks. The
+        whole response is encoded before any of it is sent. If encoding
+        fails, the call's error is set and the error response is returned
+        instead."""
+        try:
+            return list(self.jsonEncoder.iterencode(jsonCall))
+        except Exception as e:
+            self.addMessage("Could not encode the response to " + str(jsonCall.function) + ": " + str(e))
+            jsonCall.setError("Could not encode response:  " + str(e))
+            jsonCall.data = None
+            return list(self.jsonEncoder.iterencode(jsonCall))
+
+    def encodeResponse(self, jsonCall):
+        """Encode the result of an evaluated call. Returns the response and
+        its protocol content type. JSON responses are returned as a list of
+        encoded chunks."""
+        if jsonCall.responseIsBinary and jsonCall.getError():
+            # A binary op that failed has no payload to send, so report the
+            # error as a normal JSON response instead.
+            jsonCall.responseIsBinary = False
+            jsonCall.data = None
 
-        conn.send(response)
-        conn.close()
+        if not jsonCall.responseIsBinary:
+            return (self.encodeJson(jsonCall), protocol.CONTENT_JSON)
+
+        #print("About to send binary response with length " + str(len(jsonCall.data)))
+        return (jsonCall.data, protocol.CONTENT_BINARY)
+
+    def prepareResponse(self, jsonCall):
+        """Encode the result of an evaluated call so that it can be sent
+        without the state lock. Binary data is copied, since it may be a
+        live mesh array that changes as soon as the lock is released.
+        Returns the response and its protocol content type."""
+        response, contentType = self.encodeResponse(jsonCall)
+        if contentType == protocol.CONTENT_BINARY:
+            response = protocol.copyBuffers(response)
+        return (response, contentType)
+
+    def sendResponse(self, conn, jsonCall, prepared=None):
+        """Send the result of an evaluated call to conn. prepared is the
+        result of prepareResponse, if the response was already encoded."""
+        if prepared is None:
+            prepared = self.encodeResponse(jsonCall)
+        response, contentType = prepared
+        protocol.sendResponse(conn, jsonCall, response, contentType,
+                              compressionThreshold=self.socketConfig.get('compressionThreshold'))
+
+    def sendStream(self, conn, jsonCall):
+        """Send the response of a streaming call: its JSON data, then each
+        binary block of jsonCall.stream as soon as it is produced, then a
+        final JSON response reporting the number of blocks sent, or the
+        error that ended the stream. Blocks are only produced as fast as
+        the client reads them, since each send waits until the previous
+        block fits into the socket's buffer. Streams must therefore not
+        read the human's state, as this runs without the state lock."""
+        threshold = self.socketConfig.get('compressionThreshold')
+        stream = jsonCall.stream
+        jsonCall.stream = None
+        protocol.sendResponse(conn, jsonCall, self.encodeJson(jsonCall), protocol.CONTENT_JSON,
+                              compressionThreshold=threshold, flags=protocol.FLAG_STREAM)
+        blocks = 0
+        while True:
+            try:
+                block = next(stream)
+            except StopIteration:
+                break
+            except Exception as e:
+                self.addMessage("Exception while streaming " + jsonCall.function + ": " + str(e))
+                jsonCall.setError("runtime exception:  " + str(e))
+                break
+            protocol.sendResponse(conn, jsonCall, block, protocol.CONTENT_BINARY,
+                                  compressionThreshold=threshold, flags=protocol.FLAG_STREAM)
+            blocks += 1
+        jsonCall.data = {"blocks": blocks}
+        protocol.sendResponse(conn, jsonCall, self.encodeJson(jsonCall), protocol.CONTENT_JSON,
+                              compressionThreshold=threshold)
 
     def addMessage(self,message,newLine = True):
         self.log.debug("addMessage: ", message)
+        if threading.current_thread() is not threading.main_thread():
+            # Widgets may only be touched from the GUI thread
+            if self.dispatcher:
+                self.dispatcher.signalAddMessage.emit(message)
+            return
         if newLine:
             message = message + "\n"
         self.scriptText.addText(message)
 
     def openSocket(self):
         self.addMessage("Starting server thread.")
-        self.workerthread = WorkerThread(socketConfig=self.socketConfig)
-        self.workerthread.signalEvaluateCall.connect(self.evaluateCall)
+        self.dispatcher = RequestDispatcher(self, poolSize=self.socketConfig.get('threadPoolSize'),
+                                            maxQueueDepth=self.socketConfig.get('maxQueueDepth'))
+        self.dispatcher.signalAddMessage.connect(self.threadMessage)
+        if self.socketConfig.get('engine') == 'asyncio':
+            serverClass = AsyncServerThread
+        else:
+            serverClass = WorkerThread
+        self.workerthread = serverClass(socketConfig=self.socketConfig, dispatcher=self.dispatcher)
         self.workerthread.signalAddMessage.connect(self.threadMessage)
         self.workerthread.start()
 
@@ -199,6 +378,12 @@ class SocketTaskView(gui3d.TaskView):
         if self.workerthread:
             self.workerthread.stopListening()
         self.workerthread = None
+        if self.dispatcher:
+            self.dispatcher.shutdown()
+        if isPy3:
+            self.sharedArrays.close()
+            self.resultCache.clear()
+            self.meshops.poseCache.clear()
 
 
 category = None
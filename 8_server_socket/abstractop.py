@@ -5,19 +5,75 @@ from sys import exc_info
 import traceback
 import sys
 
+import numpy as np
+
 from core import G
 
+# Priority classes for queued calls. Lower values are evaluated first.
+PRIORITY_INTERACTIVE = 0
+PRIORITY_NORMAL = 1
+PRIORITY_BULK = 2
+
 class AbstractOp():
 
     def __init__(self, sockettaskview):
         self.parent = sockettaskview
         self.functions = dict()
+        # Functions that only read the human's state and may therefore be
+        # evaluated on a worker thread instead of the GUI thread. They must
+        # not read data that MakeHuman changes in place (see dispatcher)
+        self.threadSafe = set()
+        # Priority class per function, PRIORITY_NORMAL if not listed
+        self.priorities = dict()
+        # Parts of the human (see humanstate) each function's result depends
+        # on. Functions listed here report an etag and honour ifNoneMatch.
+        self.dependsOn = dict()
+        # Functions whose results are kept in the server's result cache.
+        # They must be listed in dependsOn as well.
+        self.cached = set()
+        # Functions that answer with a stream of responses (see
+        # SocketTaskView.sendStream). They can not be part of a batch.
+        self.streaming = set()
         self.human = sockettaskview.human
         self.api = G.app.mhapi
 
     def hasOp(self,function):
         return function in self.functions.keys()
 
+    def isThreadSafe(self,function,jsonCall=None):
+        return function in self.threadSafe
+
+    def getPriority(self,function):
+        return self.priorities.get(function, PRIORITY_NORMAL)
+
+    def getDependencies(self,function,jsonCall=None):
+        return self.dependsOn.get(function, ())
+
+    def isCached(self,function):
+        return function in self.cached and function in self.dependsOn
+
+    def isStreaming(self,function):
+        return function in self.streaming
+
+    def setBinaryResponse(self,jsonCall,array,key=None):
+        """Make a numpy array the binary response of jsonCall. If the client set
+        the "sharedMemory" param, the array is published in a shared memory
+        segment instead, and the (JSON) response tells where to find it. key
+        identifies the segment and defaults to the function name."""
+        if jsonCall.getParam("sharedMemory"):
+            store = self.parent.sharedArrays
+            if not store.isAvailable():
+                raise RuntimeError("Shared memory requires Python 3.8 or later")
+            if key is None:
+                key = jsonCall.getFunction()
+            jsonCall.responseIsBinary = False
+            jsonCall.data = store.publish(key, array)
+        else:
+            # The array itself is sent, through a memoryview, so there is no
+            # need for a copy unless it is not contiguous.
+            jsonCall.responseIsBinary = True
+            jsonCall.data = np.ascontiguousarray(array)
+
     def evaluateOp(self,conn,jsoncall):
 
         try:
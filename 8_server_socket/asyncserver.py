@@ -0,0 +1,209 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+
+"""
+asyncio based alternative to WorkerThread.
+
+All client connections are served from a single event loop running in its
+own QThread, so a client that stalls in the middle of a request only ever
+holds up itself. Reads and writes are bounded by the readTimeout and
+writeTimeout settings, and idle keep-alive connections are dropped after
+keepAliveTimeout seconds.
+
+Complete requests are handed to the same RequestDispatcher as the blocking
+server uses, so ops are evaluated exactly as before. Select this engine by
+setting "engine" to "asyncio" in socket.cfg.
+"""
+
+import asyncio
+import os
+import socket
+import stat
+
+import gui3d
+
+from . import protocol
+
+mhapi = gui3d.app.mhapi
+
+from PyQt5 import QtCore
+qtSignal = QtCore.pyqtSignal
+
+QThread = mhapi.ui.QtCore.QThread
+
+
+class AsyncConnection():
+    """Socket-like wrapper around an asyncio stream writer. Ops and the
+    dispatcher run outside the event loop thread, so every write is
+    scheduled on the loop and waited for, which also gives the caller
+    backpressure from slow clients."""
+
+    def __init__(self, loop, writer, writeTimeout):
+        self.loop = loop
+        self.writer = writer
+        self.writeTimeout = writeTimeout
+
+    async def _write(self, data):
+        self.writer.write(data)
+        await asyncio.wait_for(self.writer.drain(), self.writeTimeout)
+
+    def sendall(self, data):
+        future = asyncio.run_coroutine_threadsafe(self._write(data), self.loop)
+        try:
+            future.result()
+        except asyncio.TimeoutError:
+            self.close()
+            raise socket.timeout("Write timed out after " + str(self.writeTimeout) + " seconds")
+
+    def close(self):
+        self.loop.call_soon_threadsafe(self.writer.close)
+
+
+class AsyncServerThread(QThread):
+
+    signalAddMessage = qtSignal(str)
+
+    def __init__(self, parent=None, socketConfig=None, dispatcher=None):
+        QThread.__init__(self, parent)
+        self.dispatcher = dispatcher
+        self.exiting = False
+        self.loop = None
+        self.servers = []
+        self.log = mhapi.utility.getLogChannel("socket")
+        self.socketConfig = {'host' : '127.0.0.1',
+                             'port' : 12345,
+                             'tcp' : True,
+                             'unixSocketPath' : '',
+                             'keepAliveTimeout' : 30,
+                             'readTimeout' : 30,
+                             'writeTimeout' : 30,
+                             'maxRequestSize' : 64 * 1024 * 1024}
+        if socketConfig and isinstance(socketConfig, dict):
+            for key in self.socketConfig.keys():
+                self.socketConfig[key] = socketConfig.get(key, self.socketConfig[key])
+
+    def addMessage(self,message,newLine = True):
+        self.signalAddMessage.emit(message)
+
+    def run(self):
+        if self.exiting:
+            return
+        self.addMessage("Opening asyncio server socket... ")
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+
+        if self.socketConfig.get('tcp'):
+            try:
+                self.servers.append(self.loop.run_until_complete(
+                    asyncio.start_server(self.handleClient, self.socketConfig.get('host'), self.socketConfig.get('port'),
+                                         reuse_address=True, backlog=100)))
+                self.addMessage("Opened on host {0}\nOpened at port {1}\n".format(self.socketConfig.get('host'), self.socketConfig.get('port')))
+            except OSError as e:
+                self.addMessage('Bind failed: ' + str(e) + "\n")
+
+        path = self.socketConfig.get('unixSocketPath')
+        if path:
+            try:
+                if os.path.exists(path) and stat.S_ISSOCK(os.stat(path).st_mode):
+                    # Left behind by a previous run that did not shut down cleanly
+                    os.unlink(path)
+                self.servers.append(self.loop.run_until_complete(
+                    asyncio.start_unix_server(self.handleClient, path, backlog=100)))
+                self.addMessage("Opened at path {0}\n".format(path))
+            except (OSError, AttributeError, NotImplementedError) as e:
+                self.addMessage('Bind failed: ' + str(e) + "\n")
+
+        if not self.servers:
+            self.loop.close()
+            return
+
+        try:
+            self.loop.run_forever()
+        finally:
+            tasks = asyncio.all_tasks(self.loop)
+            for task in tasks:
+                task.cancel()
+            self.loop.run_until_complete(asyncio.gather(*tasks, return_exceptions=True))
+            self.loop.close()
+
+    async def readRequest(self, reader, timeout):
+        """Read one length-prefixed request. Returns None if the client closed
+        the connection cleanly between two requests."""
+        try:
+            prefix = await asyncio.wait_for(reader.readexactly(protocol.LENGTH_PREFIX_SIZE), timeout)
+        except asyncio.IncompleteReadError as e:
+            if not e.partial:
+                return None
+            raise
+        length = int.from_bytes(prefix, "big")
+        protocol.checkRequestLength(length, self.socketConfig.get('maxRequestSize'))
+        try:
+            return await asyncio.wait_for(reader.readexactly(length), self.socketConfig.get('readTimeout'))
+        except asyncio.IncompleteReadError as e:
+            raise protocol.RequestError("Connection closed after " + str(len(e.partial)) + " of " + str(length) + " bytes")
+
+    async def rejectRequest(self, writer, message):
+        """Answer a request that could not be read with an error, as far as
+        the connection still allows it."""
+        jsonCall = mhapi.internals.JsonCall()
+        jsonCall.setError(message)
+        try:
+            writer.write(bytes(jsonCall.serialize(), encoding='utf-8'))
+            await asyncio.wait_for(writer.drain(), self.socketConfig.get('writeTimeout'))
+        except (OSError, asyncio.TimeoutError):
+            pass
+
+    async def handleClient(self, reader, writer):
+        addr = writer.get_extra_info('peername')
+        if not addr:
+            # Unix domain socket clients are unnamed
+            addr = self.socketConfig.get('unixSocketPath')
+        self.addMessage("Connected with " + str(addr))
+        conn = AsyncConnection(self.loop, writer, self.socketConfig.get('writeTimeout'))
+        timeout = self.socketConfig.get('readTimeout')
+        try:
+            while not self.exiting:
+                data = await self.readRequest(reader, timeout)
+                if data is None:
+                    break
+                jsonCall = mhapi.internals.JsonCall(data)
+                self.addMessage("Client called '" + str(jsonCall.getFunction()) + "' (" + str(len(data)) + " bytes)")
+                keepAlive = protocol.isKeepAlive(jsonCall)
+
+                # submit() may answer the client itself when the queue is
+                # full, which would block if done from the loop thread.
+                call = await self.loop.run_in_executor(None, self.dispatcher.submit, conn, jsonCall)
+                await asyncio.wrap_future(call.future)
+
+                if not keepAlive:
+                    break
+                timeout = self.socketConfig.get('keepAliveTimeout')
+        except asyncio.TimeoutError:
+            self.addMessage("Closing connection with " + str(addr) + " after timeout")
+        except asyncio.CancelledError:
+            pass
+        except protocol.RequestError as e:
+            self.addMessage("Rejected request: " + str(e))
+            await self.rejectRequest(writer, str(e))
+        except (ValueError, KeyError) as e:
+            self.addMessage("Malformed request: " + str(e))
+            await self.rejectRequest(writer, "Malformed request: " + str(e))
+        except Exception as e:
+            self.addMessage("Connection with " + str(addr) + " failed: " + str(e))
+        finally:
+            writer.close()
+
+    def _shutdown(self):
+        for server in self.servers:
+            server.close()
+        self.loop.stop()
+        path = self.socketConfig.get('unixSocketPath')
+        if path and os.path.exists(path) and stat.S_ISSOCK(os.stat(path).st_mode):
+            os.unlink(path)
+
+    def stopListening(self):
+        if not self.exiting:
+            self.addMessage("Stopping socket connection")
+            self.exiting = True
+            if self.loop and not self.loop.is_closed():
+                self.loop.call_soon_threadsafe(self._shutdown)
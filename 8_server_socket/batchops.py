@@ -0,0 +1,71 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+
+from .abstractop import AbstractOp, PRIORITY_BULK
+from .bundle import Bundle
+from .protocol import CONTENT_JSON, ETAG_PARAM, NOT_MODIFIED_PARAM
+
+class SocketBatchOps(AbstractOp):
+
+    def __init__(self, sockettaskview):
+        super().__init__(sockettaskview)
+        self.functions["batch"] = self.batch
+        self.priorities["batch"] = PRIORITY_BULK
+
+    def _getCalls(self, jsonCall):
+        calls = jsonCall.getParam("calls")
+        if not isinstance(calls, list) or not all(isinstance(entry, dict) for entry in calls):
+            raise ValueError('"calls" must be a list of {"function": ..., "params": {...}} entries')
+        return calls
+
+    def isThreadSafe(self, function, jsonCall=None):
+        # A batch may leave the GUI thread only if every call in it may
+        if function != "batch" or jsonCall is None:
+            return False
+        try:
+            calls = self._getCalls(jsonCall)
+        except ValueError:
+            return False
+        for entry in calls:
+            ops = self.parent._getOps(entry.get("function"))
+            if ops is None or ops is self or not ops.isThreadSafe(entry.get("function")):
+                return False
+        return True
+
+    def batch(self,conn,jsonCall):
+        """Evaluate a list of calls in order and return all their results in
+        one bundle, with one section per call. Sections of binary results
+        hold the raw data, all others hold the call's JSON response."""
+        bundle = Bundle()
+
+        for entry in self._getCalls(jsonCall):
+            call = self.api.internals.JsonCall()
+            function = entry.get("function")
+            call.setFunction(function)
+            params = entry.get("params")
+            if params:
+                for key in params:
+                    call.setParam(key, params[key])
+
+            ops = self.parent._getOps(function)
+            if ops is self:
+                call.setError("batch calls can not be nested")
+            elif ops and ops.isStreaming(function):
+                call.setError("streaming calls can not be batched")
+            elif ops:
+                self.parent.evaluateOps(ops, conn, call)
+            else:
+                call.setError("Unknown command")
+
+            response, contentType = self.parent.encodeResponse(call)
+            if contentType == CONTENT_JSON:
+                response = b''.join(response)
+            info = {}
+            if call.getParam(ETAG_PARAM) is not None:
+                info["etag"] = call.getParam(ETAG_PARAM)
+            if call.getParam(NOT_MODIFIED_PARAM):
+                info["notModified"] = True
+            bundle.addSection(function, response, contentType=contentType, error=call.getError(), **info)
+
+        jsonCall.responseIsBinary = True
+        jsonCall.data = bundle.toBuffers()
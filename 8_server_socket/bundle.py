@@ -0,0 +1,96 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+
+"""
+Binary container for responses that consist of several named sections.
+
+A bundle starts with a fixed size prefix:
+
+    magic          4 bytes   b"MHBN"
+    version        uint16    BUNDLE_VERSION
+    reserved       uint16    always 0
+    headerLength   uint32    length of the JSON header that follows
+
+All fields are big-endian. The prefix is followed by a UTF-8 JSON header
+of the form {"sections": [...]}, where each section is described by a dict
+holding at least its "name", "offset" and "length". Offsets are counted
+from the start of the bundle. Section payloads follow the header.
+
+Sections added with addArray() hold a numpy array. Their header entry also
+has the array's "dtype" (as in numpy's dtype.str) and "shape", and their
+payload starts at an offset that is a multiple of ARRAY_ALIGNMENT, so a
+client can map it with numpy.frombuffer() without copying. The gaps before
+aligned payloads are filled with zero bytes, and the JSON header may be
+followed by spaces.
+"""
+
+import json
+import struct
+
+import numpy as np
+
+BUNDLE_MAGIC = b"MHBN"
+BUNDLE_VERSION = 1
+BUNDLE_PREFIX = struct.Struct("!4sHHI")
+
+ARRAY_ALIGNMENT = 64
+
+
+class Bundle():
+
+    def __init__(self):
+        self.sections = []
+        self.payloads = []
+        self.alignments = []
+
+    def addSection(self, name, payload, alignment=1, **info):
+        """Append a section. payload is anything supporting the buffer
+        protocol, info is stored as-is in the section's header entry. The
+        payload's offset is made a multiple of alignment."""
+        section = dict(info)
+        section["name"] = name
+        section["length"] = memoryview(payload).nbytes
+        self.sections.append(section)
+        self.payloads.append(payload)
+        self.alignments.append(alignment)
+
+    def addArray(self, name, array, **info):
+        """Append a section holding a numpy array, with its dtype and shape
+        in the header entry and its payload aligned to ARRAY_ALIGNMENT."""
+        array = np.ascontiguousarray(array)
+        self.addSection(name, array, alignment=ARRAY_ALIGNMENT, dtype=array.dtype.str, shape=list(array.shape), **info)
+
+    def toBuffers(self):
+        """Return the bundle as a list of buffers that, written in order,
+        make up the full bundle. Payloads are not copied."""
+
+        # Offsets are part of the header, and the header length depends on the
+        # offsets, so lay out with a guessed header length until the header
+        # fits. The guess only grows, and a header that comes out shorter is
+        # padded with spaces.
+        headerLength = 0
+        while True:
+            offset = BUNDLE_PREFIX.size + headerLength
+            padding = []
+            for section, alignment in zip(self.sections, self.alignments):
+                gap = -offset % alignment
+                padding.append(gap)
+                offset = offset + gap
+                section["offset"] = offset
+                offset = offset + section["length"]
+            header = json.dumps({"sections": self.sections}).encode("utf-8")
+            if len(header) <= headerLength:
+                header = header.ljust(headerLength)
+                break
+            headerLength = len(header)
+
+        prefix = BUNDLE_PREFIX.pack(BUNDLE_MAGIC, BUNDLE_VERSION, 0, len(header))
+        buffers = [prefix, header]
+        for payload, gap in zip(self.payloads, padding):
+            if gap:
+                buffers.append(bytes(gap))
+            buffers.append(payload)
+        return buffers
+
+    def tobytes(self):
+        return b''.join(self.toBuffers())
@@ -0,0 +1,119 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+
+"""
+Optional compression of response payloads.
+
+A client asks for compression by setting the "compression" param of a call
+to a codec name, or to a list of names in order of preference. The server
+uses the first codec in the list that it supports. The codec that was used
+is reported in the codec field of the response header, so compression is
+only applied to calls that also ask for a response header. Payloads smaller
+than the "compressionThreshold" setting are sent as they are, with codec 0.
+
+zlib and lzma are always available. lz4 (the frame format) and zstd are
+used if the lz4 and zstandard packages are installed.
+
+Compression works through the response one CHUNK_SIZE slice at a time, so
+the uncompressed data is never copied. Only the compressed output is held
+in memory in addition to it.
+"""
+
+import lzma
+import zlib
+
+try:
+    import lz4.frame
+except ImportError:
+    lz4 = None
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+COMPRESSION_PARAM = "compression"
+
+CODEC_NONE = 0
+CODEC_ZLIB = 1
+CODEC_LZMA = 2
+CODEC_LZ4 = 3
+CODEC_ZSTD = 4
+
+CHUNK_SIZE = 1024 * 1024
+
+
+class _Lz4Compressor():
+
+    def __init__(self):
+        self.compressor = lz4.frame.LZ4FrameCompressor()
+        self.started = False
+
+    def compress(self, data):
+        out = self.compressor.begin() if not self.started else b''
+        self.started = True
+        return out + self.compressor.compress(data)
+
+    def flush(self):
+        out = self.compressor.begin() if not self.started else b''
+        self.started = True
+        return out + self.compressor.flush()
+
+
+def _newCompressor(codec):
+    if codec == CODEC_ZLIB:
+        # Level 1 already gets most of the gain on mesh data, at a fraction
+        # of the cost of the default level
+        return zlib.compressobj(1)
+    if codec == CODEC_LZMA:
+        return lzma.LZMACompressor(preset=1)
+    if codec == CODEC_LZ4:
+        return _Lz4Compressor()
+    if codec == CODEC_ZSTD:
+        return zstandard.ZstdCompressor().compressobj()
+    raise ValueError("Unknown codec " + str(codec))
+
+
+def availableCodecs():
+    """Return a dict mapping the names of the supported codecs to their ids."""
+    codecs = {"zlib": CODEC_ZLIB, "lzma": CODEC_LZMA}
+    if lz4 is not None:
+        codecs["lz4"] = CODEC_LZ4
+    if zstandard is not None:
+        codecs["zstd"] = CODEC_ZSTD
+    return codecs
+
+
+def requestedCodec(jsonCall):
+    """Return the id of the codec to compress the response to jsonCall with,
+    or CODEC_NONE if the client asked for none that is supported."""
+    requested = jsonCall.getParam(COMPRESSION_PARAM)
+    if not requested:
+        return CODEC_NONE
+    if isinstance(requested, str):
+        requested = [requested]
+    codecs = availableCodecs()
+    for name in requested:
+        if name in codecs:
+            return codecs[name]
+    return CODEC_NONE
+
+
+def compressBuffers(buffers, codec):
+    """Compress the concatenation of buffers and return the result as a
+    list of bytes objects."""
+    compressor = _newCompressor(codec)
+    out = []
+    for buf in buffers:
+        view = memoryview(buf)
+        if not view.nbytes:
+            continue
+        view = view.cast('B')
+        for start in range(0, view.nbytes, CHUNK_SIZE):
+            chunk = compressor.compress(view[start:start + CHUNK_SIZE])
+            if chunk:
+                out.append(chunk)
+    chunk = compressor.flush()
+    if chunk:
+        out.append(chunk)
+    return out
@@ -4,7 +4,7 @@
 import mh
 import os
 
-from .abstractop import AbstractOp
+from .abstractop import AbstractOp, PRIORITY_INTERACTIVE
 
 class SocketDirOps(AbstractOp):
 
@@ -12,6 +12,9 @@ class SocketDirOps(AbstractOp):
         super().__init__(sockettaskview)
         self.functions["getUserDir"] = self.getUserDir
         self.functions["getSysDir"] = self.getSysDir
+        self.threadSafe.update(["getUserDir", "getSysDir"])
+        self.priorities["getUserDir"] = PRIORITY_INTERACTIVE
+        self.priorities["getSysDir"] = PRIORITY_INTERACTIVE
 
     def getUserDir(self,conn,jsonCall):
         jsonCall.data = os.path.abspath(mh.getPath())
@@ -0,0 +1,198 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+
+"""
+Routing of incoming calls to the thread that should evaluate them.
+
+Calls to functions that an op has declared thread-safe (pure reads of the
+human's state) are evaluated on a small pool of worker threads, so a slow
+read does not block the MakeHuman UI. Every other call is handed to the Qt
+GUI thread through a signal, as before.
+
+A read/write lock keeps the two apart: any number of thread-safe calls may
+run at the same time, but a call on the GUI thread waits until they are
+finished and holds off new ones while it runs. The lock only orders calls
+from the socket. Edits made in MakeHuman's own UI do not take it, so
+thread-safe functions must only read data that MakeHuman replaces rather
+than changes in place.
+
+Responses are encoded, and binary data copied, while the lock is held.
+They are sent after it is released, on a pool thread, so a client that
+reads slowly holds up neither the GUI thread nor other calls.
+
+Both paths are fed from bounded priority queues. When a queue is full the
+call is answered right away with a "server busy" error instead of piling up,
+and within a queue calls from a lower priority class (see AbstractOp) are
+evaluated first, so small interactive calls overtake bulk exports.
+"""
+
+import itertools
+import queue
+import threading
+
+from concurrent.futures import Future, ThreadPoolExecutor
+
+from PyQt5 import QtCore
+qtSignal = QtCore.pyqtSignal
+QObject = QtCore.QObject
+
+
+class ReadWriteLock():
+    """Lock that allows many concurrent readers or a single writer. Waiting
+    writers take precedence over new readers, so a stream of reads cannot
+    starve the GUI thread."""
+
+    def __init__(self):
+        self._cond = threading.Condition(threading.Lock())
+        self._readers = 0
+        self._writer = False
+        self._waitingWriters = 0
+
+    def acquireRead(self):
+        with self._cond:
+            while self._writer or self._waitingWriters:
+                self._cond.wait()
+            self._readers += 1
+
+    def releaseRead(self):
+        with self._cond:
+            self._readers -= 1
+            if not self._readers:
+                self._cond.notify_all()
+
+    def acquireWrite(self):
+        with self._cond:
+            self._waitingWriters += 1
+            while self._writer or self._readers:
+                self._cond.wait()
+            self._waitingWriters -= 1
+            self._writer = True
+
+    def releaseWrite(self):
+        with self._cond:
+            self._writer = False
+            self._cond.notify_all()
+
+
+class PendingCall():
+    """A call handed to the dispatcher. The future is resolved with the
+    evaluated JsonCall once the response has been sent to conn."""
+
+    def __init__(self, conn, jsonCall):
+        self.conn = conn
+        self.jsonCall = jsonCall
+        self.future = Future()
+
+
+class RequestQueue(queue.PriorityQueue):
+    """Bounded queue of PendingCalls, ordered by priority class and then by
+    arrival."""
+
+    def __init__(self, maxsize):
+        queue.PriorityQueue.__init__(self, maxsize)
+        self._counter = itertools.count()
+
+    def putCall(self, call, priority):
+        self.put_nowait((priority, next(self._counter), call))
+
+    def getCall(self):
+        return self.get_nowait()[2]
+
+
+class RequestDispatcher(QObject):
+
+    signalEvaluateCall = qtSignal()
+    signalAddMessage = qtSignal(str)
+
+    def __init__(self, sockettaskview, poolSize=4, maxQueueDepth=32):
+        QObject.__init__(self)
+        self.taskview = sockettaskview
+        self.pool = ThreadPoolExecutor(max_workers=max(1, poolSize))
+        self.stateLock = ReadWriteLock()
+        self.guiQueue = RequestQueue(maxQueueDepth)
+        self.poolQueue = RequestQueue(maxQueueDepth)
+        self.signalEvaluateCall.connect(self.evaluatePending)
+
+    def submit(self, conn, jsonCall):
+        """Queue jsonCall for evaluation and return its PendingCall. May be
+        called from any thread. If the queue is full, the client is told so
+        and the returned call is already done."""
+        call = PendingCall(conn, jsonCall)
+        priority = self.taskview.getCallPriority(jsonCall)
+        try:
+            if self.taskview.isThreadSafeCall(jsonCall):
+                self.poolQueue.putCall(call, priority)
+                self.pool.submit(self.evaluateNextThreadSafe)
+            else:
+                self.guiQueue.putCall(call, priority)
+                self.signalEvaluateCall.emit()
+        except queue.Full:
+            self._reject(call, "Server busy, too many queued requests")
+        return call
+
+    def _reject(self, call, message):
+        call.jsonCall.setError(message)
+        try:
+            self.taskview.sendResponse(call.conn, call.jsonCall)
+        except BaseException as e:
+            call.future.set_exception(e)
+        else:
+            call.future.set_result(call.jsonCall)
+
+    def evaluatePending(self):
+        """Slot run on the GUI thread for calls that must not leave it. Each
+        emit of signalEvaluateCall corresponds to one queued call."""
+        try:
+            call = self.guiQueue.getCall()
+        except queue.Empty:
+            return
+        self._evaluate(call, True)
+
+    def evaluateNextThreadSafe(self):
+        try:
+            call = self.poolQueue.getCall()
+        except queue.Empty:
+            return
+        self._evaluate(call, False)
+
+    def _evaluate(self, call, exclusive):
+        if exclusive:
+            self.stateLock.acquireWrite()
+        else:
+            self.stateLock.acquireRead()
+        try:
+            prepared = self.taskview.evaluateCall(call.conn, call.jsonCall)
+        except BaseException as e:
+            call.future.set_exception(e)
+            return
+        finally:
+            if exclusive:
+                self.stateLock.releaseWrite()
+            else:
+                self.stateLock.releaseRead()
+        if not exclusive:
+            self._send(call, prepared)
+            return
+        # Never wait for a client on the GUI thread
+        try:
+            self.pool.submit(self._send, call, prepared)
+        except RuntimeError as e:
+            # The pool is shut down along with the socket
+            call.future.set_exception(e)
+
+    def _send(self, call, prepared):
+        """Send the response of an evaluated call, or its stream if prepared
+        is None. Runs without the state lock, so a client that reads slowly
+        holds up neither the GUI thread nor other calls."""
+        try:
+            if prepared is None:
+                self.taskview.sendStream(call.conn, call.jsonCall)
+            else:
+                self.taskview.sendResponse(call.conn, call.jsonCall, prepared)
+        except BaseException as e:
+            call.future.set_exception(e)
+        else:
+            call.future.set_result(call.jsonCall)
+
+    def shutdown(self):
+        self.pool.shutdown(wait=False)
@@ -0,0 +1,20 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+
+"""
+Run-length encoding of face masks for getBodyMeshInfo and getProxiesInfo.
+
+Only depends on numpy, so it can be benchmarked without MakeHuman.
+"""
+
+import numpy as np
+
+
+def boolsToRunLengthIdx(boolArray):
+    """Return the runs of true values in boolArray as a list of
+    [first, last] index pairs."""
+    mask = np.asarray(boolArray, dtype=bool)
+    # A run starts where the padded mask goes from false to true and ends
+    # where it goes back, so the changes come in start/end pairs
+    edges = np.flatnonzero(np.diff(np.concatenate(([False], mask, [False]))))
+    return np.stack([edges[0::2], edges[1::2] - 1], axis=1).tolist()
@@ -0,0 +1,91 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+
+"""
+Version counters for the parts of the human that clients fetch.
+
+Each part (see STATE_KEYS) has a version that is bumped whenever a human
+change event affects it. Versions are drawn from one increasing counter, so
+the highest version among the parts a function depends on changes whenever
+any of those parts changes. That maximum is used as the function's etag.
+The counter starts from the current time in milliseconds, which keeps etags
+from an earlier run of MakeHuman from matching by accident.
+"""
+
+import itertools
+import threading
+import time
+
+STATE_COORDS = "coords"
+STATE_TOPOLOGY = "topology"
+STATE_SKELETON = "skeleton"
+STATE_WEIGHTS = "weights"
+STATE_PROXIES = "proxies"
+
+STATE_KEYS = (STATE_COORDS, STATE_TOPOLOGY, STATE_SKELETON, STATE_WEIGHTS, STATE_PROXIES)
+
+# Parts affected by each kind of human change event. Changes not listed
+# here are assumed to affect everything.
+CHANGES = {
+    "modifier": (STATE_COORDS, STATE_SKELETON),
+    "targets": (STATE_COORDS, STATE_SKELETON),
+    "poseChange": (STATE_COORDS, STATE_SKELETON),
+    "poseRefresh": (STATE_COORDS, STATE_SKELETON),
+    "expression": (STATE_COORDS, STATE_SKELETON),
+    "skeleton": (STATE_SKELETON, STATE_WEIGHTS),
+    "proxy": (STATE_COORDS, STATE_TOPOLOGY, STATE_WEIGHTS, STATE_PROXIES),
+    "proxyChange": (STATE_TOPOLOGY, STATE_PROXIES),
+    "subdivide": (STATE_COORDS, STATE_TOPOLOGY),
+    "smooth": (STATE_COORDS, STATE_TOPOLOGY),
+    "material": (),
+    }
+
+
+class HumanState():
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.counter = itertools.count(int(time.time() * 1000))
+        initial = next(self.counter)
+        self.versions = dict((key, initial) for key in STATE_KEYS)
+
+    def bump(self, keys):
+        """Give the parts in keys a new version."""
+        with self.lock:
+            version = next(self.counter)
+            for key in keys:
+                self.versions[key] = version
+
+    def onHumanChanged(self, event):
+        """Bump the parts affected by event and return them."""
+        changed = CHANGES.get(getattr(event, "change", None), STATE_KEYS)
+        self.bump(changed)
+        return changed
+
+    def getVersion(self, keys):
+        """Return the etag for data depending on the parts in keys, or 0 if
+        keys is empty."""
+        with self.lock:
+            return max([self.versions[key] for key in keys], default=0)
+
+
+class SnapshotHistory():
+    """Copies of arrays as they were sent at recent versions, so later calls
+    can send only what changed since a version the client already has. At
+    most historyLength versions are kept per key."""
+
+    def __init__(self, historyLength=8):
+        self.historyLength = historyLength
+        self.snapshots = dict()
+        self.lock = threading.Lock()
+
+    def get(self, key, version):
+        with self.lock:
+            return self.snapshots.get(key, dict()).get(version)
+
+    def put(self, key, version, array):
+        with self.lock:
+            versions = self.snapshots.setdefault(key, dict())
+            versions[version] = array
+            while len(versions) > self.historyLength:
+                del versions[min(versions)]
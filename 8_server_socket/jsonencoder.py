@@ -0,0 +1,219 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+
+"""
+Linear-time encoder for JSON responses.
+
+The output is the same as that of JsonCall.serialize(): the same layout and
+whitespace, and floats formatted with eight decimals wherever they appear
+in the hierarchy. Instead of building the response through repeated string
+concatenation, the encoder walks the data once and yields the result as a
+sequence of UTF-8 chunks of roughly CHUNK_SIZE bytes, which can be written
+to the socket as they are produced.
+
+Numbers come out exactly as serialize() writes them: Python floats (and
+numpy float64) with eight decimals, numpy float32 and float16 values with
+str(), and integers with str(). A few inputs that serialize() turns into
+invalid JSON, or fails on, are encoded properly here: booleans become
+true/false, bytes are decoded as UTF-8 text, and numpy integers of a single
+digit are numbers like any other.
+
+Numeric ndarrays, and lists (or lists of equally long lists) holding only
+one kind of number, are formatted a block of values at a time with a
+single %-format call instead of value by value. The text is the same either
+way.
+"""
+
+import re
+
+import numpy as np
+
+CHUNK_SIZE = 65536
+
+# Number of values formatted at once by the numeric fast path
+BLOCK_SIZE = 8192
+
+# Non-string values whose string form looks like a number are emitted
+# as a number, as serialize() does
+_NUM_FORMAT = re.compile(r"^[\-]?[0-9][0-9]*\.?[0-9]+$")
+
+# Floats that serialize() formats with eight decimals, and the numpy floats
+# it formats with str()
+_FLOAT_TYPES = {float, np.float64}
+_SHORT_FLOAT_TYPES = {np.float16, np.float32}
+_INT_TYPES = {int, np.int8, np.int16, np.int32, np.int64, np.uint8, np.uint16, np.uint32, np.uint64}
+
+
+class RawJson(str):
+    """Text that is already JSON, such as a cached result. It is emitted as
+    it is instead of being encoded as a string."""
+    pass
+
+
+class JsonEncoder():
+
+    def __init__(self, chunkSize=CHUNK_SIZE, vectorize=True):
+        self.chunkSize = chunkSize
+        self.vectorize = vectorize
+
+    def _stringAsJson(self, val):
+        if isinstance(val, bytes):
+            val = val.decode('utf-8')
+        return "\"" + val.replace("\"", "\\\"") + "\""
+
+    def _scalarAsJson(self, val):
+        """Return the JSON text for a scalar value, or None if val is a
+        container."""
+        if val is None:
+            return "null"
+        if isinstance(val, RawJson):
+            return str(val)
+        if isinstance(val, (str, bytes)):
+            return self._stringAsJson(val)
+        if isinstance(val, (bool, np.bool_)):
+            return "true" if val else "false"
+        if isinstance(val, float):
+            return "{0:.8f}".format(val)
+        if isinstance(val, np.floating):
+            return str(val)
+        if isinstance(val, (int, np.integer)):
+            return str(int(val))
+        if type(val) is dict or hasattr(val, '__len__'):
+            return None
+        text = str(val)
+        if _NUM_FORMAT.match(text):
+            return text
+        return "\"" + text + "\""
+
+    def _formatOf(self, values):
+        types = set(map(type, values))
+        if types <= _FLOAT_TYPES:
+            return "%.8f"
+        if types <= _SHORT_FLOAT_TYPES:
+            return "%s"
+        if types <= _INT_TYPES:
+            return "%d"
+        return None
+
+    def _numericBlock(self, val):
+        """If val is a homogeneous block of numbers, return (format, values,
+        rowLength) with the values flattened into a list. rowLength is 0 for
+        a flat sequence. Return None for anything else."""
+        if isinstance(val, np.ndarray):
+            if val.size == 0 or val.ndim > 2:
+                return None
+            rowLength = val.shape[1] if val.ndim == 2 else 0
+            if val.dtype.type in _SHORT_FLOAT_TYPES:
+                # Same text as str() of each element
+                return ("%s", val.ravel().astype(str).tolist(), rowLength)
+            if val.dtype.kind == 'f':
+                fmt = "%.8f"
+            elif val.dtype.kind in 'iu':
+                fmt = "%d"
+            else:
+                return None
+            return (fmt, val.ravel().tolist(), rowLength)
+        if not isinstance(val, (list, tuple)) or not val:
+            return None
+        first = val[0]
+        if type(first) in _FLOAT_TYPES or type(first) in _SHORT_FLOAT_TYPES or type(first) in _INT_TYPES:
+            fmt = self._formatOf(val)
+            return (fmt, val, 0) if fmt else None
+        if isinstance(first, (list, tuple)) and first:
+            rowLength = len(first)
+            for row in val:
+                if not isinstance(row, (list, tuple)) or len(row) != rowLength:
+                    return None
+            values = [item for row in val for item in row]
+            fmt = self._formatOf(values)
+            return (fmt, values, rowLength) if fmt else None
+        return None
+
+    def _iterNumericBlock(self, fmt, values, rowLength):
+        if rowLength:
+            template = "[ " + ",".join([fmt] * rowLength) + " ]"
+            step = max(1, BLOCK_SIZE // rowLength) * rowLength
+        else:
+            template = fmt
+            rowLength = 1
+            step = BLOCK_SIZE
+        yield "[ "
+        for start in range(0, len(values), step):
+            if start:
+                yield ","
+            block = values[start:start + step]
+            yield ",".join([template] * (len(block) // rowLength)) % tuple(block)
+        yield " ]"
+
+    def _iterValue(self, val):
+        scalar = self._scalarAsJson(val)
+        if scalar is not None:
+            yield scalar
+            return
+        block = self._numericBlock(val) if self.vectorize else None
+        if block is not None:
+            yield from self._iterNumericBlock(*block)
+        elif type(val) is dict:
+            yield "{ "
+            first = True
+            for key in val.keys():
+                if first:
+                    first = False
+                else:
+                    yield ", "
+                yield "\"" + str(key) + "\": "
+                yield from self._iterValue(val[key])
+            yield " }"
+        else:
+            yield "[ "
+            n = len(val)
+            for i in range(n):
+                item = val[i]
+                scalar = self._scalarAsJson(item)
+                if scalar is not None:
+                    yield scalar
+                else:
+                    yield from self._iterValue(item)
+                if i + 1 < n:
+                    yield ","
+            yield " ]"
+
+    def _iterCall(self, jsonCall):
+        yield "{\n"
+        yield "  \"function\": \"" + jsonCall.getFunction() + "\",\n"
+        yield "  \"error\": \"" + jsonCall.getError() + "\",\n"
+        yield "  \"params\": {\n"
+        first = True
+        for key in jsonCall.params.keys():
+            if first:
+                first = False
+            else:
+                yield ",\n"
+            yield "    \"" + str(key) + "\": "
+            yield from self._iterValue(jsonCall.params[key])
+        yield "\n  },\n"
+        yield "  \"data\": "
+        yield from self._iterValue(jsonCall.getData())
+        yield "\n}\n"
+
+    def iterencode(self, jsonCall):
+        """Yield the serialized jsonCall as UTF-8 encoded chunks."""
+        parts = []
+        size = 0
+        for part in self._iterCall(jsonCall):
+            parts.append(part)
+            size += len(part)
+            if size >= self.chunkSize:
+                yield "".join(parts).encode('utf-8')
+                parts = []
+                size = 0
+        if parts:
+            yield "".join(parts).encode('utf-8')
+
+    def encodeValue(self, val):
+        """Return the JSON text for a single value."""
+        return "".join(self._iterValue(val))
+
+    def encode(self, jsonCall):
+        """Return the serialized jsonCall as one bytes object."""
+        return b''.join(self.iterencode(jsonCall))
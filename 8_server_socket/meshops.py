@@ -1,14 +1,21 @@
 #!/usr/bin/python3
 # -*- coding: utf-8 -*-
 
+import json
 import os
 import pprint
 import math
+import threading
 import numpy as np
 import time
 
-from transformations import quaternion_from_matrix
-from .abstractop import AbstractOp
+from .abstractop import AbstractOp, PRIORITY_INTERACTIVE, PRIORITY_BULK
+from .bundle import Bundle
+from .facemask import boolsToRunLengthIdx
+from .posecache import PoseFileCache
+from .skinning import SkinWeights, skinningMatrices, posesToGlobal, skinCoords
+from .humanstate import STATE_COORDS, STATE_TOPOLOGY, STATE_SKELETON, STATE_WEIGHTS, STATE_PROXIES, SnapshotHistory
+from .protocol import CONTENT_JSON, ETAG_PARAM, responseHeaderVersion
 from core import G
 from material import getSkinBlender
 
@@ -22,6 +29,8 @@ class SocketMeshOps(AbstractOp):
         # Sync operations
         self.functions["getCoord"] = self.getCoord
         self.functions["getPose"] = self.getPose
+        self.functions["getPoseBinary"] = self.getPoseBinary
+        self.functions["streamAnimation"] = self.streamAnimation
 
         # Import body operations
         self.functions["getBodyFacesBinary"] = self.getBodyFacesBinary
@@ -33,6 +42,11 @@ class SocketMeshOps(AbstractOp):
         self.functions["getBodyWeightInfo"] = self.getBodyWeightInfo
         self.functions["getBodyWeightsVertList"] = self.getBodyWeightsVertList
         self.functions["getBodyWeights"] = self.getBodyWeights
+        self.functions["getBodySkinWeightsCSR"] = self.getBodySkinWeightsCSR
+        self.functions["getSkinWeightsTopK"] = self.getSkinWeightsTopK
+        self.functions["getBodyMeshBundle"] = self.getBodyMeshBundle
+        self.functions["getBodyFaceMaskBinary"] = self.getBodyFaceMaskBinary
+        self.functions["getBodyCoordDelta"] = self.getBodyCoordDelta
 
         # Import proxy operations
         self.functions["getProxiesInfo"] = self.getProxiesInfo
@@ -44,24 +58,160 @@ class SocketMeshOps(AbstractOp):
         self.functions["getProxyWeightInfo"] = self.getProxyWeightInfo
         self.functions["getProxyWeightsVertList"] = self.getProxyWeightsVertList
         self.functions["getProxyWeights"] = self.getProxyWeights
+        self.functions["getProxySkinWeightsCSR"] = self.getProxySkinWeightsCSR
+        self.functions["getProxyMeshBundle"] = self.getProxyMeshBundle
+        self.functions["getProxyFaceMaskBinary"] = self.getProxyFaceMaskBinary
+        self.functions["getProxyCoordDelta"] = self.getProxyCoordDelta
 
 
         # Import skeleton operations
         self.functions["getSkeleton"] = self.getSkeleton
+        self.functions["getSkeletonBinary"] = self.getSkeletonBinary
+        self.functions["getPosedCoordsBinary"] = self.getPosedCoordsBinary
+
+        # Pure reads that can be evaluated off the GUI thread. Only data
+        # that MakeHuman replaces rather than changes in place qualifies,
+        # since edits made in its own UI do not take the state lock:
+        # topology and UVs, but not coordinates, face masks or bone
+        # matrices. The weight and material operations are left out since
+        # they fill caches on the human and its proxies.
+        self.threadSafe.update([
+            "getBodyFacesBinary",
+            "getBodyTextureCoordsBinary",
+            "getBodyFaceUVMappingsBinary",
+            "getProxyFacesBinary",
+            "getProxyTextureCoordsBinary",
+            "getProxyFaceUVMappingsBinary",
+            # Only reads the animation track, never poses the human. Its
+            # blocks are sent after the state lock is released, so a slow
+            # client holds up neither the GUI thread nor other calls.
+            "streamAnimation"
+            ])
+
+        self.priorities["getPose"] = PRIORITY_INTERACTIVE
+        for function in self.functions.keys():
+            if function.endswith("Binary") or function.endswith("Bundle") or function.endswith("Weights") or function.endswith("WeightsVertList"):
+                self.priorities[function] = PRIORITY_BULK
+        self.priorities["getCoord"] = PRIORITY_BULK
+        self.priorities["getPoseBinary"] = PRIORITY_INTERACTIVE
+        self.priorities["streamAnimation"] = PRIORITY_BULK
+        self.streaming.add("streamAnimation")
+        self.priorities["getBodySkinWeightsCSR"] = PRIORITY_BULK
+        self.priorities["getProxySkinWeightsCSR"] = PRIORITY_BULK
+        self.priorities["getSkinWeightsTopK"] = PRIORITY_BULK
+        # Deltas are what live-link clients poll while the user edits
+        self.priorities["getBodyCoordDelta"] = PRIORITY_INTERACTIVE
+        self.priorities["getProxyCoordDelta"] = PRIORITY_INTERACTIVE
+
+        bodyMesh = (STATE_COORDS, STATE_TOPOLOGY)
+        proxyMesh = (STATE_COORDS, STATE_TOPOLOGY, STATE_PROXIES)
+        self.dependsOn.update({
+            "getCoord": (STATE_COORDS,),
+            "getBodyVerticesBinary": (STATE_COORDS,),
+            "getBodyFacesBinary": (STATE_TOPOLOGY,),
+            "getBodyTextureCoordsBinary": (STATE_TOPOLOGY,),
+            "getBodyFaceUVMappingsBinary": (STATE_TOPOLOGY,),
+            "getBodyFaceMaskBinary": (STATE_TOPOLOGY,),
+            "getBodyMeshInfo": bodyMesh,
+            "getBodyMeshBundle": bodyMesh,
+            "getBodyCoordDelta": bodyMesh,
+            "getBodyWeightInfo": (STATE_WEIGHTS,),
+            "getBodyWeightsVertList": (STATE_WEIGHTS,),
+            "getBodyWeights": (STATE_WEIGHTS,),
+            "getBodySkinWeightsCSR": (STATE_WEIGHTS,),
+            "getProxiesInfo": (STATE_TOPOLOGY, STATE_PROXIES),
+            "getProxyVerticesBinary": proxyMesh,
+            "getProxyFacesBinary": proxyMesh,
+            "getProxyTextureCoordsBinary": proxyMesh,
+            "getProxyFaceUVMappingsBinary": proxyMesh,
+            "getProxyFaceMaskBinary": proxyMesh,
+            "getProxyMeshBundle": proxyMesh,
+            "getProxyCoordDelta": proxyMesh,
+            "getProxyWeightInfo": (STATE_WEIGHTS, STATE_PROXIES),
+            "getProxyWeightsVertList": (STATE_WEIGHTS, STATE_PROXIES),
+            "getProxyWeights": (STATE_WEIGHTS, STATE_PROXIES),
+            "getProxySkinWeightsCSR": (STATE_WEIGHTS, STATE_PROXIES),
+            "getSkinWeightsTopK": (STATE_WEIGHTS, STATE_PROXIES),
+            "getSkeleton": (STATE_SKELETON,),
+            "getSkeletonBinary": (STATE_SKELETON,),
+            "getPosedCoordsBinary": (STATE_COORDS, STATE_TOPOLOGY, STATE_SKELETON, STATE_WEIGHTS, STATE_PROXIES)
+            })
+
+        # Rebuilding the weights means calling getVertexWeights on the human
+        # and proxy, which is slow compared to sending the result again
+        self.cached.update([
+            "getBodyWeightInfo",
+            "getBodyWeightsVertList",
+            "getBodyWeights",
+            "getBodySkinWeightsCSR",
+            "getProxiesInfo",
+            "getProxyWeightInfo",
+            "getProxyWeightsVertList",
+            "getProxyWeights",
+            "getProxySkinWeightsCSR",
+            "getSkinWeightsTopK",
+            "getSkeleton",
+            "getSkeletonBinary",
+            "getPosedCoordsBinary"
+            ])
+
+        self.coordHistory = SnapshotHistory()
+        # Prepared skin weights per mesh and weights version, and skinning
+        # matrices per pose version. The body and all proxies are skinned
+        # with the same matrices.
+        self.skinWeightsHistory = SnapshotHistory(historyLength=2)
+        self.skinningHistory = SnapshotHistory(historyLength=2)
+        self.poseCache = PoseFileCache()
+
+        # Proxies by uuid, built on first use and dropped when proxies change
+        self.proxyIndex = None
+        self.proxyIndexGeneration = 0
+        self.proxyIndexLock = threading.Lock()
+
+    def getDependencies(self, function, jsonCall=None):
+        # Coordinates posed from a .bvh file also depend on the file and the
+        # frame, which the human's state versions know nothing about. Such
+        # calls get no etag, ignore ifNoneMatch and are not cached.
+        if function == "getPosedCoordsBinary" and jsonCall is not None and jsonCall.getParam("poseFilename") is not None:
+            return ()
+        return super().getDependencies(function, jsonCall)
 
     def getCoord(self,conn,jsonCall):
         jsonCall.data = self.human.mesh.coord
 
     def getBodyVerticesBinary(self,conn,jsonCall):
-        jsonCall.responseIsBinary = True
         coord = self._getBodyMesh().coord
-        jsonCall.data = coord.tobytes()
+        self.setBinaryResponse(jsonCall, coord)
+
+    def invalidateProxyIndex(self):
+        """Called when proxies were added or removed. The index is rebuilt by
+        the next lookup."""
+        with self.proxyIndexLock:
+            self.proxyIndex = None
+            self.proxyIndexGeneration += 1
+
+    def _buildProxyIndex(self):
+        with self.proxyIndexLock:
+            generation = self.proxyIndexGeneration
+        index = dict((p.uuid, p) for p in self.api.mesh.getAllProxies(includeBodyProxy=True))
+        with self.proxyIndexLock:
+            # Only keep the index if no proxy changed while it was built
+            if generation == self.proxyIndexGeneration:
+                self.proxyIndex = index
+        return index
 
     def _getProxyByUUID(self,strUuid):
-        for p in self.api.mesh.getAllProxies(includeBodyProxy=True):
-            if p.uuid == strUuid:
-                return p
-        return None
+        index = self.proxyIndex
+        fresh = index is None
+        if fresh:
+            index = self._buildProxyIndex()
+        proxy = index.get(strUuid)
+        if proxy is None and not fresh:
+            # In case a change went by without an event, look once more
+            proxy = self._buildProxyIndex().get(strUuid)
+        if proxy is None:
+            raise ValueError("No proxy with uuid '" + str(strUuid) + "'")
+        return proxy
 
     def getProxiesInfo(self,conn,jsonCall):
         objects = []
@@ -111,9 +261,8 @@ class SocketMeshOps(AbstractOp):
         jsonCall.data = objects
 
     def getBodyFacesBinary(self,conn,jsonCall):
-        jsonCall.responseIsBinary = True
         faces = self._getBodyMesh().fvert
-        jsonCall.data = faces.tobytes()
+        self.setBinaryResponse(jsonCall, faces)
 
     def getBodyMaterialInfo(self,conn,jsonCall):
         if self.human.material.name == 'XrayMaterial' and self.human._backUpMaterial:
@@ -123,34 +272,75 @@ class SocketMeshOps(AbstractOp):
         jsonCall.data = self.api.assets.materialToHash(material)
 
     def getBodyTextureCoordsBinary(self,conn,jsonCall):
-        jsonCall.responseIsBinary = True
         texco = self._getBodyMesh().texco
-        jsonCall.data = texco.tobytes()
+        self.setBinaryResponse(jsonCall, texco)
 
     def getBodyFaceUVMappingsBinary(self,conn,jsonCall):
-        jsonCall.responseIsBinary = True
         faces = self._getBodyMesh().fuvs
-        jsonCall.data = faces.tobytes()
+        self.setBinaryResponse(jsonCall, faces)
 
     def _getBodyMesh(self):
         return self.human._Object__seedMesh
 
+    def _setMeshBundleResponse(self, jsonCall, mesh):
+        """Respond with a bundle holding the mesh's coord, fvert, texco and
+        fuvs arrays, plus its face_mask as "faceMask" if it has one."""
+        bundle = Bundle()
+        bundle.addArray("coord", mesh.coord)
+        bundle.addArray("fvert", mesh.fvert)
+        bundle.addArray("texco", mesh.texco)
+        bundle.addArray("fuvs", mesh.fuvs)
+        if hasattr(mesh, "face_mask"):
+            bundle.addArray("faceMask", mesh.face_mask)
+        jsonCall.responseIsBinary = True
+        jsonCall.data = bundle.toBuffers()
+
+    def getBodyMeshBundle(self,conn,jsonCall):
+        self._setMeshBundleResponse(jsonCall, self._getBodyMesh())
+
+    def _setCoordDeltaResponse(self, jsonCall, key, coord):
+        """Respond with a bundle of the vertices that moved since the version
+        in the "since" param, an earlier etag of the same function. The
+        bundle holds an "indices" array and a "coord" array with the new
+        positions of those vertices. If the client's version is unknown, the
+        topology changed, or the delta would not be smaller, the bundle only
+        holds a "coord" array with all vertices."""
+        coord = np.array(coord)
+        version = jsonCall.getParam(ETAG_PARAM)
+        since = jsonCall.getParam("since")
+        previous = self.coordHistory.get(key, int(since)) if since is not None else None
+        self.coordHistory.put(key, version, coord)
+
+        bundle = Bundle()
+        if previous is not None and previous.shape == coord.shape:
+            indices = np.flatnonzero(np.any(coord != previous, axis=1)).astype(np.uint32)
+            changed = coord[indices]
+            if indices.nbytes + changed.nbytes < coord.nbytes:
+                bundle.addArray("indices", indices)
+                bundle.addArray("coord", changed)
+        if not bundle.sections:
+            bundle.addArray("coord", coord)
+        jsonCall.responseIsBinary = True
+        jsonCall.data = bundle.toBuffers()
+
+    def getBodyCoordDelta(self,conn,jsonCall):
+        self._setCoordDeltaResponse(jsonCall, "body", self._getBodyMesh().coord)
+
     def _boolsToRunLenghtIdx(self, boolArray):
-        out = []
-        i = 0
-        needNewRun = True
-
-        while i < len(boolArray):
-            if boolArray[i]:
-                if needNewRun:
-                    out.append([i,i])
-                    needNewRun = False
-                out[ len(out) - 1 ][1] = i
-            else:
-                needNewRun = True
-            i = i + 1
+        """Return the runs of true values in boolArray as a list of
+        [first, last] index pairs."""
+        return boolsToRunLengthIdx(boolArray)
 
-        return out
+    def _getFaceMask(self, mesh):
+        """The mesh's face_mask, or all faces visible if it has none."""
+        if hasattr(mesh, "face_mask"):
+            return np.asarray(mesh.face_mask, dtype=bool)
+        return np.ones(len(mesh.fvert), dtype=bool)
+
+    def getBodyFaceMaskBinary(self,conn,jsonCall):
+        """The body's face mask as a bit array, packed with np.packbits: the
+        first face is the most significant bit of the first byte."""
+        self.setBinaryResponse(jsonCall, np.packbits(self._getFaceMask(self._getBodyMesh())))
 
 
     def getBodyMeshInfo(self,conn,jsonCall):
@@ -217,34 +407,73 @@ class SocketMeshOps(AbstractOp):
         jsonCall.data["skinColor"] = skinColor.asTuple() + (1.0, )
 
 
-    def _boneToHash(self, boneHierarchy, bone, recursionLevel=1):
+    def _collectBones(self, skeleton):
+        """Return the bones in depth-first order, and for each the index of
+        its parent in that order, or -1 for roots. Bones deeper than 30
+        levels are left out."""
+        bones = []
+        parents = []
+        stack = [(bone, -1, 1) for bone in reversed(skeleton.roots)]
+        while stack:
+            bone, parent, recursionLevel = stack.pop()
+            index = len(bones)
+            bones.append(bone)
+            parents.append(parent)
+            # Just a security measure.
+            if recursionLevel < 30:
+                stack.extend((child, index, recursionLevel + 1) for child in reversed(bone.children))
+        return (bones, parents)
+
+    def _boneRolls(self, restMatrices):
+        """Return the roll of each bone, given their stacked (n, 4, 4) global
+        rest matrices. This is quaternion_from_matrix() applied to all bones
+        at once, followed by the roll formula. Bones with a quaternion w
+        below 1e-4 get a roll of exactly 0, which is also returned as a
+        boolean mask."""
+        rest = np.asarray(restMatrices, dtype=np.float64)
+        n = len(rest)
+        if n == 0:
+            return (np.zeros(0), np.zeros(0, dtype=bool))
+        m = np.stack((rest[:, 0], -rest[:, 2], rest[:, 1]), axis=1)[:, :, :3]
+
+        # The quaternion is the eigenvector of K with the largest eigenvalue.
+        # eigh only reads the lower triangle.
+        K = np.zeros((n, 4, 4))
+        K[:, 0, 0] = m[:, 0, 0] - m[:, 1, 1] - m[:, 2, 2]
+        K[:, 1, 0] = m[:, 0, 1] + m[:, 1, 0]
+        K[:, 1, 1] = m[:, 1, 1] - m[:, 0, 0] - m[:, 2, 2]
+        K[:, 2, 0] = m[:, 0, 2] + m[:, 2, 0]
+        K[:, 2, 1] = m[:, 1, 2] + m[:, 2, 1]
+        K[:, 2, 2] = m[:, 2, 2] - m[:, 0, 0] - m[:, 1, 1]
+        K[:, 3, 0] = m[:, 2, 1] - m[:, 1, 2]
+        K[:, 3, 1] = m[:, 0, 2] - m[:, 2, 0]
+        K[:, 3, 2] = m[:, 1, 0] - m[:, 0, 1]
+        K[:, 3, 3] = m[:, 0, 0] + m[:, 1, 1] + m[:, 2, 2]
+        K /= 3.0
+        w, V = np.linalg.eigh(K)
+        q = V[np.arange(n), :, np.argmax(w, axis=1)][:, [3, 0, 1, 2]]
+        q[q[:, 0] < 0.0] *= -1.0
+
+        qw = q[:, 0]
+        qy = q[:, 2]
+        zero = qw < 1e-4
+        roll = np.where(zero, 0.0, math.pi - 2 * np.arctan2(qy, qw))
+        roll[roll < -math.pi] += 2 * math.pi
+        roll[roll > math.pi] -= 2 * math.pi
+        return (roll, zero)
+
+    def _boneToHash(self, bone, roll):
         out = {}
         out["name"] = bone.name
         out["headPos"] = bone.headPos
         out["tailPos"] = bone.tailPos
 
         restMatrix = bone.matRestGlobal
-        matrix = np.array((restMatrix[0], -restMatrix[2], restMatrix[1], restMatrix[3]))
-        qw, qx, qy, qz = quaternion_from_matrix(matrix)
-        if qw < 1e-4:
-            roll = 0
-        else:
-            roll = math.pi - 2 * math.atan2(qy, qw)
-        if roll < -math.pi:
-            roll += 2 * math.pi
-        elif roll > math.pi:
-            roll -= 2 * math.pi
-
         out["matrix"] = [list(restMatrix[0,:]), list(restMatrix[1,:]), list(restMatrix[2,:]), list(restMatrix[3,:])]
         out["roll"] = roll
 
         out["children"] = []
-        boneHierarchy.append(out)
-
-        # Just a security measure.
-        if recursionLevel < 30:
-            for child in bone.children:
-                self._boneToHash(out["children"], child, recursionLevel+1)
+        return out
 
     def getSkeleton(self, conn, jsonCall):
 
@@ -258,14 +487,237 @@ class SocketMeshOps(AbstractOp):
 
         if not skeleton is None:
             out["name"] = skeleton.name
-            for bone in skeleton.roots:
-                self._boneToHash(boneHierarchy, bone)
+            bones, parents = self._collectBones(skeleton)
+            rolls, zero = self._boneRolls([bone.matRestGlobal for bone in bones])
+            hashes = []
+            for i, bone in enumerate(bones):
+                hashes.append(self._boneToHash(bone, 0 if zero[i] else float(rolls[i])))
+                if parents[i] < 0:
+                    boneHierarchy.append(hashes[i])
+                else:
+                    hashes[parents[i]]["children"].append(hashes[i])
         else:
             out["name"] = "none"
 
         out["bones"] = boneHierarchy
         jsonCall.data = out
 
+    def getSkeletonBinary(self, conn, jsonCall):
+        """The data of getSkeleton as a bundle of arrays over the bones in
+        depth-first order: "parents" (-1 for roots), "headPos", "tailPos",
+        "rolls" and the global rest "matrices". The "skeleton" JSON section
+        holds the skeleton's "name", its "offset" and the "bones" names."""
+        skeleton = self.human.getSkeleton()
+        yOffset = -1 * self.human.getJointPosition('ground')[1]
+        info = {"offset": [0.0, 0.0, float(yOffset)]}
+
+        if skeleton is not None:
+            info["name"] = skeleton.name
+            bones, parents = self._collectBones(skeleton)
+        else:
+            info["name"] = "none"
+            bones, parents = ([], [])
+        info["bones"] = [bone.name for bone in bones]
+
+        restMatrices = np.array([bone.matRestGlobal for bone in bones]).reshape(-1, 4, 4)
+        rolls, zero = self._boneRolls(restMatrices)
+
+        bundle = Bundle()
+        bundle.addSection("skeleton", json.dumps(info).encode('utf-8'), contentType=CONTENT_JSON)
+        bundle.addArray("parents", np.array(parents, dtype=np.int32))
+        bundle.addArray("headPos", np.array([bone.headPos for bone in bones]).reshape(-1, 3))
+        bundle.addArray("tailPos", np.array([bone.tailPos for bone in bones]).reshape(-1, 3))
+        bundle.addArray("rolls", rolls)
+        bundle.addArray("matrices", restMatrices)
+        jsonCall.responseIsBinary = True
+        jsonCall.data = bundle.toBuffers()
+
+    def _getRestCoords(self, mesh):
+        """The coordinates of mesh before posing. Meshes that are not bound
+        to the skeleton are never posed, so their coordinates are the rest
+        coordinates."""
+        try:
+            return self.human.getRestCoordinates(mesh.name)
+        except (RuntimeError, TypeError, ValueError):
+            return mesh.coord
+
+    def _getSkinWeights(self, key, rawWeights, boneIndex):
+        version = self.parent.humanState.getVersion((STATE_TOPOLOGY, STATE_WEIGHTS, STATE_PROXIES))
+        skinWeights = self.skinWeightsHistory.get(key, version)
+        if skinWeights is None:
+            boneKeys = sorted(rawWeights.data.keys())
+            counts = [len(rawWeights.data[name][0]) for name in boneKeys]
+            bones = np.repeat([boneIndex[name] for name in boneKeys], counts)
+            skinWeights = SkinWeights(self._flattenWeights(rawWeights, 0), bones, self._flattenWeights(rawWeights, 1))
+            self.skinWeightsHistory.put(key, version, skinWeights)
+        return skinWeights
+
+    def _getSkinningMatrices(self, skeleton, bones, poseFilename, frame):
+        """Skinning matrices for the current pose, or for the frame of the
+        .bvh file if poseFilename is given."""
+        restGlobal = np.array([bone.matRestGlobal for bone in bones], dtype=np.float64).reshape(-1, 4, 4)
+        if poseFilename is not None:
+            track = self.poseCache.getAnimationTrack(poseFilename, skeleton)
+            if not 0 <= frame < track.nFrames:
+                raise ValueError('"frame" must be at least 0 and less than the ' + str(track.nFrames) + ' frames of ' + poseFilename)
+            boneIndex = dict((bone.name, i) for i, bone in enumerate(bones))
+            parents = [boneIndex[bone.parent.name] if bone.parent is not None else -1 for bone in bones]
+            poseGlobal = posesToGlobal(restGlobal, parents, track.getAtFramePos(frame))
+            return skinningMatrices(restGlobal, poseGlobal)
+
+        version = self.parent.humanState.getVersion((STATE_SKELETON,))
+        matrices = self.skinningHistory.get("current", version)
+        if matrices is None:
+            poseGlobal = np.array([bone.matPoseGlobal if bone.matPoseGlobal is not None else bone.matRestGlobal
+                                   for bone in bones], dtype=np.float64).reshape(-1, 4, 4)
+            matrices = skinningMatrices(restGlobal, poseGlobal)
+            self.skinningHistory.put("current", version, matrices)
+        return matrices
+
+    def getPosedCoordsBinary(self, conn, jsonCall):
+        """The float32 (numVertices, 3) coordinates of the body, or of the
+        proxy given by the "uuid" param, skinned on the server with linear
+        blend skinning. By default the current pose is applied. With a
+        "poseFilename" .bvh file, frame "frame" (default 0) of it is applied
+        instead, without posing the human. Such calls report no etag."""
+        skeleton = self.human.getBaseSkeleton()
+        bones = skeleton.getBones()
+        boneIndex = dict((bone.name, i) for i, bone in enumerate(bones))
+        humanWeights = self.human.getVertexWeights(skeleton)
+        uuid = jsonCall.getParam("uuid")
+        if uuid:
+            proxy = self._getProxyByUUID(uuid)
+            mesh = self._getProxyMesh(proxy)
+            rawWeights = proxy.getVertexWeights(humanWeights, skeleton, allowCache=True)
+            key = "proxy:" + uuid
+        else:
+            mesh = self._getBodyMesh()
+            rawWeights = humanWeights
+            key = "body"
+
+        poseFilename = jsonCall.getParam("poseFilename")
+        if poseFilename is not None and os.path.splitext(poseFilename)[1] != ".bvh":
+            raise ValueError('"poseFilename" must be a .bvh file')
+        matrices = self._getSkinningMatrices(skeleton, bones, poseFilename, self._intParam(jsonCall, "frame", 0))
+        skinWeights = self._getSkinWeights(key, rawWeights, boneIndex)
+        self.setBinaryResponse(jsonCall, skinCoords(self._getRestCoords(mesh), skinWeights, matrices),
+                               key=jsonCall.getFunction() + ":" + key)
+
+    def _flattenWeights(self, rawWeights, column):
+        """Concatenate column 0 (vertex indices) or 1 (weights) of all
+        bones' weights, in sorted bone order."""
+        boneKeys = sorted(rawWeights.data.keys())
+        return np.concatenate([rawWeights.data[key][column] for key in boneKeys])
+
+    def _setSkinWeightsCSRResponse(self, jsonCall, rawWeights):
+        """Respond with all skin weights in compressed sparse row form: a
+        bundle with a "bones" section holding the sorted bone names as a JSON
+        list, and "boneOffsets", "vertices" and "weights" arrays. The
+        vertices and weights of bone i are at boneOffsets[i] up to
+        boneOffsets[i + 1]."""
+        boneKeys = sorted(rawWeights.data.keys())
+        counts = [len(rawWeights.data[key][0]) for key in boneKeys]
+        offsets = np.zeros(len(boneKeys) + 1, dtype=np.uint32)
+        offsets[1:] = np.cumsum(counts)
+
+        bundle = Bundle()
+        bundle.addSection("bones", json.dumps(boneKeys).encode('utf-8'), contentType=CONTENT_JSON)
+        bundle.addArray("boneOffsets", offsets)
+        bundle.addArray("vertices", self._flattenWeights(rawWeights, 0))
+        bundle.addArray("weights", self._flattenWeights(rawWeights, 1))
+        jsonCall.responseIsBinary = True
+        jsonCall.data = bundle.toBuffers()
+
+    def _topKWeights(self, rawWeights, numVertices, k):
+        """Return (boneKeys, joints, weights), where joints and weights are
+        [numVertices, k] arrays with the k strongest influences of each
+        vertex, strongest first, renormalized to sum to 1. joints index
+        boneKeys. Unused slots have joint 0 and weight 0."""
+        boneKeys = sorted(rawWeights.data.keys())
+        counts = [len(rawWeights.data[key][0]) for key in boneKeys]
+        bones = np.repeat(np.arange(len(boneKeys)), counts)
+        vertices = self._flattenWeights(rawWeights, 0).astype(np.int64)
+        weights = self._flattenWeights(rawWeights, 1).astype(np.float32)
+
+        # Group by vertex, strongest first, and number the influences of each
+        # vertex from 0 to drop all but the first k
+        order = np.lexsort((-weights, vertices))
+        vertices = vertices[order]
+        rank = np.arange(len(vertices)) - np.searchsorted(vertices, vertices, side='left')
+        keep = rank < k
+        vertices = vertices[keep]
+        rank = rank[keep]
+
+        numVertices = max(numVertices, int(vertices[-1]) + 1 if len(vertices) else 0)
+        denseJoints = np.zeros((numVertices, k), dtype=np.int64)
+        denseWeights = np.zeros((numVertices, k), dtype=np.float32)
+        denseJoints[vertices, rank] = bones[order][keep]
+        denseWeights[vertices, rank] = weights[order][keep]
+
+        total = denseWeights.sum(axis=1, keepdims=True)
+        np.divide(denseWeights, total, out=denseWeights, where=total > 0)
+        return (boneKeys, denseJoints, denseWeights)
+
+    def _setTopKWeightsResponse(self, jsonCall, rawWeights, numVertices):
+        """Respond with per-vertex skin weights, limited to the "maxInfluences"
+        (default 4) strongest bones per vertex. "indexType" is "uint8" or
+        "uint16" (default: the smallest that fits) and "weightType" is
+        "float32" (default), "float16" or "unorm16". The bundle has a "bones"
+        JSON section with the sorted bone names, and [numVertices, k]
+        "joints" and "weights" arrays. unorm16 weights are scaled to 65535
+        and still sum to exactly 65535 per weighted vertex."""
+        k = int(jsonCall.getParam("maxInfluences") or 4)
+        if k < 1:
+            raise ValueError("maxInfluences must be at least 1")
+        boneKeys, joints, weights = self._topKWeights(rawWeights, numVertices, k)
+
+        indexType = jsonCall.getParam("indexType") or ("uint8" if len(boneKeys) <= 256 else "uint16")
+        if indexType not in ("uint8", "uint16"):
+            raise ValueError("indexType must be uint8 or uint16")
+        if len(boneKeys) > np.iinfo(indexType).max + 1:
+            raise ValueError(str(len(boneKeys)) + " bones do not fit in " + indexType + " indices")
+        joints = joints.astype(indexType)
+
+        weightType = jsonCall.getParam("weightType") or "float32"
+        if weightType == "unorm16":
+            quantized = np.rint(weights * 65535).astype(np.int64)
+            # Give the rounding error to the strongest influence, so weighted
+            # vertices keep an exact sum of 65535
+            weighted = quantized.any(axis=1)
+            quantized[weighted, 0] += 65535 - quantized[weighted].sum(axis=1)
+            weights = quantized.astype(np.uint16)
+        elif weightType in ("float32", "float16"):
+            weights = weights.astype(weightType)
+        else:
+            raise ValueError("weightType must be float32, float16 or unorm16")
+
+        bundle = Bundle()
+        bundle.addSection("bones", json.dumps(boneKeys).encode('utf-8'), contentType=CONTENT_JSON)
+        bundle.addArray("joints", joints)
+        bundle.addArray("weights", weights)
+        jsonCall.responseIsBinary = True
+        jsonCall.data = bundle.toBuffers()
+
+    def getSkinWeightsTopK(self, conn, jsonCall):
+        """Per-vertex skin weights of the body, or of the proxy given by the
+        "uuid" param. See _setTopKWeightsResponse for the params."""
+        skeleton = self.human.getSkeleton()
+        humanWeights = self.human.getVertexWeights(skeleton)
+        uuid = jsonCall.getParam("uuid")
+        if uuid:
+            proxy = self._getProxyByUUID(uuid)
+            rawWeights = proxy.getVertexWeights(humanWeights, skeleton, allowCache=True)
+            numVertices = len(self._getProxyMesh(proxy).coord)
+        else:
+            rawWeights = humanWeights
+            numVertices = len(self._getBodyMesh().coord)
+        self._setTopKWeightsResponse(jsonCall, rawWeights, numVertices)
+
+    def getBodySkinWeightsCSR(self, conn, jsonCall):
+        skeleton = self.human.getSkeleton()
+        rawWeights = self.human.getVertexWeights(skeleton)
+        self._setSkinWeightsCSRResponse(jsonCall, rawWeights)
+
     def getBodyWeightInfo(self, conn, jsonCall):
 
         out = {}
@@ -305,44 +757,20 @@ class SocketMeshOps(AbstractOp):
         jsonCall.data = out
 
     def getBodyWeightsVertList(self, conn, jsonCall):
-        jsonCall.responseIsBinary = True
-
         skeleton = self.human.getSkeleton()
         rawWeights = self.human.getVertexWeights(skeleton)
 
-        allVerts = None
-
-        boneKeys = list(rawWeights.data.keys())
-        boneKeys.sort()
-
-        for key in boneKeys:
-
-            if allVerts is None:
-                allVerts = rawWeights.data[key][0]
-            else:
-                allVerts = np.append(allVerts, rawWeights.data[key][0])
+        allVerts = self._flattenWeights(rawWeights, 0)
 
-        jsonCall.data = allVerts.tobytes()
+        self.setBinaryResponse(jsonCall, allVerts)
 
     def getBodyWeights(self, conn, jsonCall):
-        jsonCall.responseIsBinary = True
-
         skeleton = self.human.getSkeleton()
         rawWeights = self.human.getVertexWeights(skeleton)
 
-        allVerts = None
-
-        boneKeys = list(rawWeights.data.keys())
-        boneKeys.sort()
-
-        for key in boneKeys:
+        allVerts = self._flattenWeights(rawWeights, 1)
 
-            if allVerts is None:
-                allVerts = rawWeights.data[key][1]
-            else:
-                allVerts = np.append(allVerts, rawWeights.data[key][1])
-
-        jsonCall.data = allVerts.tobytes()
+        self.setBinaryResponse(jsonCall, allVerts)
 
     def getProxyWeightInfo(self, conn, jsonCall):
 
@@ -390,8 +818,6 @@ class SocketMeshOps(AbstractOp):
         jsonCall.data = out
 
     def getProxyWeightsVertList(self, conn, jsonCall):
-        jsonCall.responseIsBinary = True
-
         uuid = jsonCall.params["uuid"]
         proxy = self._getProxyByUUID(uuid)
         skeleton = self.human.getSkeleton()
@@ -403,23 +829,11 @@ class SocketMeshOps(AbstractOp):
         #stop = int(round(time.time() * 1000))
         #print("Calculating rawWeights for " + proxy.name + " took " + str(stop - start) + " milliseconds")
 
-        allVerts = None
-
-        boneKeys = list(rawWeights.data.keys())
-        boneKeys.sort()
-
-        for key in boneKeys:
-
-            if allVerts is None:
-                allVerts = rawWeights.data[key][0]
-            else:
-                allVerts = np.append(allVerts, rawWeights.data[key][0])
+        allVerts = self._flattenWeights(rawWeights, 0)
 
-        jsonCall.data = allVerts.tobytes()
+        self.setBinaryResponse(jsonCall, allVerts, key=jsonCall.getFunction() + ":" + uuid)
 
     def getProxyWeights(self, conn, jsonCall):
-        jsonCall.responseIsBinary = True
-
         uuid = jsonCall.params["uuid"]
         proxy = self._getProxyByUUID(uuid)
         skeleton = self.human.getSkeleton()
@@ -431,30 +845,32 @@ class SocketMeshOps(AbstractOp):
         #stop = int(round(time.time() * 1000))
         #print("Calculating rawWeights for " + proxy.name + " took " + str(stop - start) + " milliseconds")
 
-        allVerts = None
+        allVerts = self._flattenWeights(rawWeights, 1)
 
-        boneKeys = list(rawWeights.data.keys())
-        boneKeys.sort()
-
-        for key in boneKeys:
+        self.setBinaryResponse(jsonCall, allVerts, key=jsonCall.getFunction() + ":" + uuid)
 
-            if allVerts is None:
-                allVerts = rawWeights.data[key][1]
-            else:
-                allVerts = np.append(allVerts, rawWeights.data[key][1])
-
-        jsonCall.data = allVerts.tobytes()
+    def getProxySkinWeightsCSR(self, conn, jsonCall):
+        uuid = jsonCall.params["uuid"]
+        proxy = self._getProxyByUUID(uuid)
+        skeleton = self.human.getSkeleton()
 
-    def getPose(self,conn,jsonCall):
+        humanWeights = self.human.getVertexWeights(skeleton)
+        rawWeights = proxy.getVertexWeights(humanWeights, skeleton, allowCache=True)
+        self._setSkinWeightsCSRResponse(jsonCall, rawWeights)
 
+    def _setPoseFromParams(self, jsonCall):
         poseFilename = jsonCall.params.get("poseFilename") # use get, since might not be there
-        
+
         if poseFilename is not None:
             filename, file_extension = os.path.splitext(poseFilename)
             if file_extension == ".mhpose":
-                self.api.skeleton.setExpressionFromFile(poseFilename)
+                self.poseCache.setExpressionFromFile(self.api, poseFilename)
             if file_extension == ".bvh":
-                self.api.skeleton.setPoseFromFile(poseFilename)
+                self.poseCache.setPoseFromFile(self.api, self.human, poseFilename)
+
+    def getPose(self,conn,jsonCall):
+
+        self._setPoseFromParams(jsonCall)
 
         self.parent.addMessage("Constructing dict with bone matrices.")
         
@@ -469,6 +885,81 @@ class SocketMeshOps(AbstractOp):
 
         jsonCall.data = skelobj
 
+    def getPoseBinary(self,conn,jsonCall):
+        """The matrices of getPose as one float32 (numBones, 4, 4) array, in
+        the order of skeleton.getBones(). The "bones" JSON section holds the
+        bone names in that order."""
+
+        self._setPoseFromParams(jsonCall)
+
+        bones = self.human.getSkeleton().getBones()
+        matrices = np.empty((len(bones), 4, 4), dtype=np.float32)
+        for i, bone in enumerate(bones):
+            matrices[i] = bone.getRestMatrix('zUpFaceNegY')
+
+        bundle = Bundle()
+        bundle.addSection("bones", json.dumps([bone.name for bone in bones]).encode('utf-8'), contentType=CONTENT_JSON)
+        bundle.addArray("matrices", matrices)
+        jsonCall.responseIsBinary = True
+        jsonCall.data = bundle.toBuffers()
+
+    def _intParam(self, jsonCall, name, default):
+        value = jsonCall.getParam(name)
+        return default if value is None else int(value)
+
+    def _animationBlocks(self, track, frames, framesPerBlock):
+        # Runs while the blocks are sent, without the state lock, so it may
+        # only read the track, which the human does not share
+        for start in range(0, len(frames), framesPerBlock):
+            blockFrames = frames[start:start + framesPerBlock]
+            block = np.zeros((len(blockFrames), track.nBones, 4, 4), dtype=np.float32)
+            for i, frame in enumerate(blockFrames):
+                pose = track.getAtFramePos(frame)
+                # Tracks store 3x4 affine matrices
+                block[i, :, :pose.shape[1], :] = pose
+            block[:, :, 3, 3] = 1
+            yield block
+
+    def streamAnimation(self,conn,jsonCall):
+        """Stream the frames of the .bvh file in "poseFilename", from
+        "startFrame" up to but not including "endFrame", every "stride"
+        frames. The file is loaded once, through the pose cache.
+
+        The first response holds the bone names, frame numbers and block
+        layout as JSON. It is followed by one binary response per block of
+        at most "framesPerBlock" frames, each a float32 (frames, numBones,
+        4, 4) array of the bones' pose matrices relative to their rest
+        pose, in the order of skeleton.getBones(). A final JSON response
+        ends the stream. Needs the "responseHeader" param, whose FLAG_STREAM
+        tells the client that more responses follow."""
+
+        if not responseHeaderVersion(jsonCall):
+            raise ValueError('streamAnimation needs the "responseHeader" param')
+        poseFilename = jsonCall.getParam("poseFilename")
+        if poseFilename is None or os.path.splitext(poseFilename)[1] != ".bvh":
+            raise ValueError('"poseFilename" must be a .bvh file')
+
+        skeleton = self.human.getBaseSkeleton()
+        track = self.poseCache.getAnimationTrack(poseFilename, skeleton)
+
+        startFrame = self._intParam(jsonCall, "startFrame", 0)
+        endFrame = min(self._intParam(jsonCall, "endFrame", track.nFrames), track.nFrames)
+        stride = self._intParam(jsonCall, "stride", 1)
+        framesPerBlock = self._intParam(jsonCall, "framesPerBlock", 64)
+        if startFrame < 0 or stride < 1 or framesPerBlock < 1:
+            raise ValueError('"startFrame" must not be negative, "stride" and "framesPerBlock" must be positive')
+        frames = range(startFrame, endFrame, stride)
+
+        jsonCall.data = {
+            "bones": [bone.name for bone in skeleton.getBones()],
+            "numFrames": track.nFrames,
+            "frameRate": track.frameRate / stride,
+            "frames": {"start": startFrame, "stop": endFrame, "stride": stride, "count": len(frames)},
+            "framesPerBlock": framesPerBlock,
+            "dtype": np.dtype(np.float32).str
+            }
+        jsonCall.stream = self._animationBlocks(track, frames, framesPerBlock)
+
     def _getProxyMesh(self, proxy):
         if proxy.type == "Proxymeshes":
             if not self.human.proxy is None and not self.human.proxy.name is None:
@@ -478,16 +969,14 @@ class SocketMeshOps(AbstractOp):
     def getProxyVerticesBinary(self,conn,jsonCall):
         uuid = jsonCall.params["uuid"]
         proxy = self._getProxyByUUID(uuid)
-        jsonCall.responseIsBinary = True
         coord = self._getProxyMesh(proxy).coord
-        jsonCall.data = coord.tobytes()
+        self.setBinaryResponse(jsonCall, coord, key=jsonCall.getFunction() + ":" + uuid)
 
     def getProxyFacesBinary(self,conn,jsonCall):
         uuid = jsonCall.params["uuid"]
         proxy = self._getProxyByUUID(uuid)
-        jsonCall.responseIsBinary = True
         faces = self._getProxyMesh(proxy).fvert
-        jsonCall.data = faces.tobytes()
+        self.setBinaryResponse(jsonCall, faces, key=jsonCall.getFunction() + ":" + uuid)
 
     def getProxyMaterialInfo(self,conn,jsonCall):
         uuid = jsonCall.params["uuid"]
@@ -507,13 +996,27 @@ class SocketMeshOps(AbstractOp):
     def getProxyTextureCoordsBinary(self,conn,jsonCall):
         uuid = jsonCall.params["uuid"]
         proxy = self._getProxyByUUID(uuid)
-        jsonCall.responseIsBinary = True
         texco = self._getProxyMesh(proxy).texco
-        jsonCall.data = texco.tobytes()
+        self.setBinaryResponse(jsonCall, texco, key=jsonCall.getFunction() + ":" + uuid)
 
     def getProxyFaceUVMappingsBinary(self,conn,jsonCall):
         uuid = jsonCall.params["uuid"]
         proxy = self._getProxyByUUID(uuid)
-        jsonCall.responseIsBinary = True
         faces = self._getProxyMesh(proxy).fuvs
-        jsonCall.data = faces.tobytes()
+        self.setBinaryResponse(jsonCall, faces, key=jsonCall.getFunction() + ":" + uuid)
+
+    def getProxyFaceMaskBinary(self,conn,jsonCall):
+        uuid = jsonCall.params["uuid"]
+        proxy = self._getProxyByUUID(uuid)
+        mask = np.packbits(self._getFaceMask(self._getProxyMesh(proxy)))
+        self.setBinaryResponse(jsonCall, mask, key=jsonCall.getFunction() + ":" + uuid)
+
+    def getProxyMeshBundle(self,conn,jsonCall):
+        uuid = jsonCall.params["uuid"]
+        proxy = self._getProxyByUUID(uuid)
+        self._setMeshBundleResponse(jsonCall, self._getProxyMesh(proxy))
+
+    def getProxyCoordDelta(self,conn,jsonCall):
+        uuid = jsonCall.params["uuid"]
+        proxy = self._getProxyByUUID(uuid)
+        self._setCoordDeltaResponse(jsonCall, "proxy:" + uuid, self._getProxyMesh(proxy).coord)
@@ -7,7 +7,7 @@ import io
 import base64
 import imutils as imutils
 
-from .abstractop import AbstractOp
+from .abstractop import AbstractOp, PRIORITY_INTERACTIVE, PRIORITY_BULK
 from core import G
 import mh
 import json
@@ -28,6 +28,14 @@ class SocketModifierOps(AbstractOp):
         self.functions["landmarks"] = self.landmarks
         self.functions["approachTarget"] = self.approachTarget
         self.functions["optimizeTargetRotation"] = self.optimizeTargetRotation
+        # Applied targets and modifier values change in place while sliders
+        # are dragged in MakeHuman's UI, so only the names are read off the
+        # GUI thread
+        self.threadSafe.update(["getAvailableModifierNames"])
+        for function in ["applyModifier", "getModifierValue", "resetCamera"]:
+            self.priorities[function] = PRIORITY_INTERACTIVE
+        for function in ["snapshot", "setTarget", "approachTarget", "optimizeTargetRotation"]:
+            self.priorities[function] = PRIORITY_BULK
         self.target = None
         self.target_image = None
         self.target_rotation = 0.0
@@ -0,0 +1,148 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+
+"""
+Cache of parsed pose files.
+
+Parsing a .bvh file and turning it into an animation track for the human's
+skeleton is by far the most expensive part of reading a pose or animation,
+so the resulting tracks are kept in small LRU caches. Entries are keyed by
+the file's path and modification time, so an edited file is parsed again.
+They are only used for the skeleton they were made for. Changes to the
+shape of the human drop all entries.
+
+streamAnimation and getPosedCoordsBinary read tracks from getAnimationTrack.
+Poses set by getPose and getPoseBinary are applied through mhapi the first
+time a file is used. The track that call activates is kept, along with the
+state it left in MakeHuman's pose library. Later calls for the same file
+activate the track again with the same human calls the pose library makes,
+and restore that state, without reading the file. Expressions (.mhpose
+files) are always applied through mhapi. Only setting the expression that
+is already current is skipped.
+"""
+
+import collections
+import os
+import threading
+import weakref
+
+import bvh
+
+from core import G
+
+# Human changes after which tracks are made again
+RESHAPE_CHANGES = ("modifier", "targets", "skeleton", "reset", "load", "random")
+
+# What loading a pose sets in the pose library: the chosen file, which is
+# saved with the model, and what it needs to scale the pose again when the
+# human's proportions change
+POSE_LIBRARY_STATE = ("currentPose", "bvh_bone_length", "bvh_root_translation")
+
+
+class PoseFileCache():
+
+    def __init__(self, maxEntries=64):
+        self.maxEntries = maxEntries
+        self.tracks = collections.OrderedDict()
+        self.poses = collections.OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+        self.currentPose = None
+        self.currentExpression = None
+
+    def _fileKey(self, filename):
+        path = os.path.abspath(filename)
+        return (path, os.path.getmtime(path))
+
+    def getAnimationTrack(self, filename, skeleton):
+        """Return the animation track for the .bvh file, parsing it only if
+        it is not cached for this version of the file and skeleton."""
+        key = self._fileKey(filename)
+        with self.lock:
+            entry = self.tracks.get(key)
+            # Compared by identity through a weak reference, since the id of
+            # a skeleton that was freed can be reused by a new one
+            if entry is not None and entry[1]() is skeleton:
+                self.tracks.move_to_end(key)
+                self.hits += 1
+                return entry[0]
+            self.misses += 1
+        track = bvh.load(filename, convertFromZUp="auto").createAnimationTrack(skeleton)
+        self._put(self.tracks, key, (track, weakref.ref(skeleton)))
+        return track
+
+    def _put(self, entries, key, entry):
+        with self.lock:
+            entries[key] = entry
+            entries.move_to_end(key)
+            while len(entries) > self.maxEntries:
+                entries.popitem(last=False)
+
+    def _getPoseLibrary(self):
+        try:
+            return G.app.getTask('Pose/Animate', 'Pose')
+        except RuntimeWarning:
+            return None
+
+    def setPoseFromFile(self, api, human, filename):
+        """Pose the human with the .bvh file, unless it already is."""
+        key = self._fileKey(filename)
+        if key == self.currentPose:
+            return
+        skeleton = human.getBaseSkeleton()
+        poseLibrary = self._getPoseLibrary()
+        with self.lock:
+            entry = self.poses.get(key)
+            if entry is not None and entry[1]() is skeleton:
+                self.poses.move_to_end(key)
+                self.hits += 1
+            else:
+                entry = None
+                self.misses += 1
+
+        if entry is None:
+            previous = human.getActiveAnimation()
+            api.skeleton.setPoseFromFile(filename)
+            track = human.getActiveAnimation()
+            # Only keep what the call activated, not a pose it left in place
+            if track is not None and track is not previous:
+                state = dict((name, getattr(poseLibrary, name, None)) for name in POSE_LIBRARY_STATE) if poseLibrary else {}
+                self._put(self.poses, key, (track, weakref.ref(skeleton), state))
+        else:
+            # As the pose library's loadPose applies a track it just loaded
+            track, _, state = entry
+            if poseLibrary:
+                for name, value in state.items():
+                    setattr(poseLibrary, name, value)
+            human.addAnimation(track)
+            human.setActiveAnimation(track.name)
+            human.setToFrame(0, update=False)
+            human.setPosed(True)
+        # Set last, since the calls above send human change events
+        self.currentPose = key
+
+    def setExpressionFromFile(self, api, filename):
+        key = self._fileKey(filename)
+        if key != self.currentExpression:
+            api.skeleton.setExpressionFromFile(filename)
+            self.currentExpression = key
+
+    def getStats(self):
+        with self.lock:
+            return {"hits": self.hits, "misses": self.misses, "entries": len(self.tracks), "poses": len(self.poses)}
+
+    def onHumanChanged(self, event):
+        self.currentPose = None
+        self.currentExpression = None
+        if getattr(event, "change", None) in RESHAPE_CHANGES:
+            with self.lock:
+                self.tracks.clear()
+                self.poses.clear()
+
+    def clear(self):
+        with self.lock:
+            self.tracks.clear()
+            self.poses.clear()
+            self.currentPose = None
+            self.currentExpression = None
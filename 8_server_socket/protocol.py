@@ -0,0 +1,226 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+
+"""
+Wire framing used between the socket server and its clients.
+
+A request is always a 4-byte big-endian length followed by that many bytes
+of UTF-8 encoded JSON. The response format depends on what the client asked
+for in the request params:
+
+* By default the raw response (JSON text or binary data) is written and the
+  connection is closed. This is what older clients expect.
+
+* If the "keepAlive" param is set, the response is written with the same
+  4-byte length prefix as the request, and the connection stays open so the
+  client can send any number of further requests over it.
+
+* If the "responseHeader" param is set to a header version (1 or 2), the
+  response is preceded by a fixed size header instead:
+
+      magic         4 bytes   b"MHRS"
+      version       uint8     header version actually used by the server
+      contentType   uint8     CONTENT_JSON or CONTENT_BINARY
+      flags         uint8     FLAG_ERROR if the call failed, FLAG_NOT_MODIFIED
+                              if the call was skipped because of ifNoneMatch,
+                              FLAG_STREAM if more responses to the call follow
+      codec         uint8     compression codec of the payload, 0 if none
+      length        uint64    number of payload bytes following the header
+      etag          uint64    version 2 only: the etag of the result, 0 if
+                              the function does not report one
+
+  All fields are big-endian. The header can be combined with keepAlive, in
+  which case it replaces the 4-byte length prefix.
+
+  Calls with a response header may also ask for a compressed payload, see
+  compression.py. The length in the header is then that of the compressed
+  payload.
+
+  Streaming calls such as streamAnimation answer with a sequence of framed
+  responses: a JSON response describing the stream, any number of binary
+  blocks, and a final JSON response. All but the final response have
+  FLAG_STREAM set. Streaming calls therefore require a response header.
+
+Responses are passed around as a single bytes-like object or as a list of
+them (for example a header followed by a numpy array). They are written
+straight from those buffers without joining or copying them first. A
+response can also be an iterator of chunks. It is read to the end before
+anything is written, so a response is never cut short halfway.
+"""
+
+import struct
+
+from .compression import CODEC_NONE, compressBuffers, requestedCodec
+
+KEEP_ALIVE_PARAM = "keepAlive"
+RESPONSE_HEADER_PARAM = "responseHeader"
+ETAG_PARAM = "etag"
+IF_NONE_MATCH_PARAM = "ifNoneMatch"
+NOT_MODIFIED_PARAM = "notModified"
+
+LENGTH_PREFIX_SIZE = 4
+
+RESPONSE_MAGIC = b"MHRS"
+RESPONSE_HEADER_VERSION = 2
+RESPONSE_HEADERS = {
+    1: struct.Struct("!4sBBBBQ"),
+    2: struct.Struct("!4sBBBBQQ")
+    }
+
+CONTENT_JSON = 0
+CONTENT_BINARY = 1
+
+FLAG_ERROR = 0x01
+FLAG_NOT_MODIFIED = 0x02
+FLAG_STREAM = 0x04
+
+# Stay well below the IOV_MAX limit of sendmsg
+MAX_SEND_BUFFERS = 512
+
+
+class RequestError(Exception):
+    """Raised when a client sends a request that can not be read."""
+    pass
+
+
+def recvExactly(conn, size):
+    """Read exactly size bytes from conn into a preallocated bytearray.
+    Returns None if the peer closed the connection before sending anything,
+    and raises RequestError if it closed in the middle of the block."""
+    data = bytearray(size)
+    view = memoryview(data)
+    pos = 0
+    while pos < size:
+        n = conn.recv_into(view[pos:], size - pos)
+        if not n:
+            if not pos:
+                return None
+            raise RequestError("Connection closed after " + str(pos) + " of " + str(size) + " bytes")
+        pos = pos + n
+    return data
+
+
+def checkRequestLength(length, maxRequestSize):
+    if maxRequestSize and length > maxRequestSize:
+        raise RequestError("Request of " + str(length) + " bytes exceeds the maximum of " + str(maxRequestSize) + " bytes")
+
+
+def readRequest(conn, maxRequestSize=None):
+    """Read one length-prefixed request from conn. Returns None if the
+    client closed the connection cleanly between two requests. Raises
+    RequestError for requests that are too large or cut short."""
+    prefix = recvExactly(conn, LENGTH_PREFIX_SIZE)
+    if prefix is None:
+        return None
+    length = int.from_bytes(prefix, "big")
+    checkRequestLength(length, maxRequestSize)
+    data = recvExactly(conn, length)
+    if data is None and length:
+        raise RequestError("Connection closed before the request body was sent")
+    return data
+
+
+def isKeepAlive(jsonCall):
+    return bool(jsonCall.getParam(KEEP_ALIVE_PARAM))
+
+
+def responseHeaderVersion(jsonCall):
+    """Return the header version to answer jsonCall with, or 0 if the client
+    did not ask for a response header."""
+    requested = jsonCall.getParam(RESPONSE_HEADER_PARAM)
+    if not requested:
+        return 0
+    try:
+        requested = int(requested)
+    except (TypeError, ValueError):
+        requested = RESPONSE_HEADER_VERSION
+    return max(1, min(requested, RESPONSE_HEADER_VERSION))
+
+
+def packResponseHeader(length, contentType=CONTENT_JSON, flags=0, version=RESPONSE_HEADER_VERSION, codec=CODEC_NONE, etag=0):
+    if version == 1:
+        return RESPONSE_HEADERS[1].pack(RESPONSE_MAGIC, version, contentType, flags, codec, length)
+    return RESPONSE_HEADERS[version].pack(RESPONSE_MAGIC, version, contentType, flags, codec, length, etag)
+
+
+def _asByteViews(buffers):
+    views = []
+    for buf in buffers:
+        view = memoryview(buf)
+        if view.nbytes:
+            views.append(view.cast('B') if view.format != 'B' or view.ndim != 1 else view)
+    return views
+
+
+def sendBuffers(conn, buffers):
+    """Write all buffers to conn, in order, without copying them. Uses
+    scatter/gather sendmsg where the connection supports it, and handles
+    partial sends."""
+    views = _asByteViews(buffers)
+    if not hasattr(conn, 'sendmsg'):
+        for view in views:
+            conn.sendall(view)
+        return
+    first = 0
+    while first < len(views):
+        sent = conn.sendmsg(views[first:first + MAX_SEND_BUFFERS])
+        while sent:
+            if sent >= views[first].nbytes:
+                sent -= views[first].nbytes
+                first += 1
+            else:
+                views[first] = views[first][sent:]
+                sent = 0
+
+
+def responseLength(response):
+    if isinstance(response, list):
+        return sum(memoryview(buf).nbytes for buf in response)
+    return memoryview(response).nbytes
+
+
+def copyBuffers(response):
+    """Return response, a bytes-like object or a list of them, as a list of
+    bytes objects. Buffers that are not bytes yet are copied, so what is
+    sent no longer changes with the arrays they came from."""
+    if _isBuffer(response):
+        response = [response]
+    return [buf if isinstance(buf, bytes) else memoryview(buf).tobytes() for buf in response]
+
+
+def _isBuffer(response):
+    try:
+        memoryview(response)
+        return True
+    except TypeError:
+        return False
+
+
+def sendResponse(conn, jsonCall, response, contentType=CONTENT_JSON, compressionThreshold=0, flags=0):
+    """Write an encoded response to conn, framed as the client requested.
+    response is a bytes-like object, a list of them or an iterator over
+    them. If the client asked for compression, responses of at least
+    compressionThreshold bytes are compressed. flags are added to the
+    flags of the response header."""
+    headerVersion = responseHeaderVersion(jsonCall)
+    if _isBuffer(response):
+        response = [response]
+    elif not isinstance(response, list):
+        response = list(response)
+    length = responseLength(response)
+    if headerVersion:
+        if jsonCall.getError():
+            flags |= FLAG_ERROR
+        if jsonCall.getParam(NOT_MODIFIED_PARAM):
+            flags |= FLAG_NOT_MODIFIED
+        codec = requestedCodec(jsonCall)
+        if codec != CODEC_NONE and length >= compressionThreshold:
+            response = compressBuffers(response, codec)
+            length = responseLength(response)
+        else:
+            codec = CODEC_NONE
+        response = [packResponseHeader(length, contentType, flags, headerVersion, codec,
+                                       jsonCall.getParam(ETAG_PARAM) or 0)] + response
+    elif isKeepAlive(jsonCall):
+        response = [length.to_bytes(LENGTH_PREFIX_SIZE, "big")] + response
+    sendBuffers(conn, response)
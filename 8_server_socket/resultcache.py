@@ -0,0 +1,106 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+
+"""
+Memoization of results that are expensive to compute, such as skin weights.
+
+Ops opt in per function through their "cached" set. Such functions must also
+declare what they depend on in "dependsOn". Results are stored already
+encoded: JSON data as RawJson text, binary data as one bytes object.
+Entries are keyed by function, params and etag, so a stale entry can never
+be served. They are also dropped as soon as a human change event touches
+what they depend on. The least recently used entries are evicted once the
+total size exceeds maxBytes.
+"""
+
+import collections
+import json
+import threading
+
+from .jsonencoder import RawJson
+
+# Params that only affect how a response is transported, not its contents
+TRANSPORT_PARAMS = frozenset([
+    "keepAlive",
+    "responseHeader",
+    "compression",
+    "etag",
+    "ifNoneMatch",
+    "notModified"
+    ])
+
+
+class ResultCache():
+
+    def __init__(self, maxBytes=64 * 1024 * 1024):
+        self.maxBytes = maxBytes
+        self.entries = collections.OrderedDict()
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.lock = threading.Lock()
+
+    def makeKey(self, jsonCall):
+        params = dict((key, value) for key, value in jsonCall.params.items() if key not in TRANSPORT_PARAMS)
+        return (jsonCall.function, jsonCall.getParam("etag"), json.dumps(params, sort_keys=True, default=str))
+
+    def get(self, key):
+        """Return (responseIsBinary, data) for key, or None."""
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return (entry[0], entry[1])
+
+    def put(self, key, dependencies, jsonCall, encoder):
+        """Store the result of the evaluated jsonCall under key, and replace
+        its data with the stored copy so it is not encoded twice."""
+        if jsonCall.responseIsBinary:
+            data = jsonCall.data
+            if not isinstance(data, list):
+                data = [data]
+            data = b''.join(memoryview(buf).cast('B') for buf in data if memoryview(buf).nbytes)
+            size = len(data)
+        else:
+            data = RawJson(encoder.encodeValue(jsonCall.data))
+            # What the text takes on the wire, not its number of characters
+            size = len(data.encode('utf-8'))
+        jsonCall.data = data
+        if size > self.maxBytes:
+            return
+        with self.lock:
+            if key in self.entries:
+                self.size -= self.entries.pop(key)[3]
+            self.entries[key] = (jsonCall.responseIsBinary, data, frozenset(dependencies), size)
+            self.size += size
+            while self.size > self.maxBytes:
+                oldKey, entry = self.entries.popitem(last=False)
+                self.size -= entry[3]
+                self.evictions += 1
+
+    def invalidate(self, changed):
+        """Drop all entries that depend on any of the parts in changed."""
+        changed = set(changed)
+        with self.lock:
+            for key in [key for key, entry in self.entries.items() if entry[2] & changed]:
+                self.size -= self.entries.pop(key)[3]
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.size = 0
+
+    def getStats(self):
+        with self.lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "entries": len(self.entries),
+                "bytes": self.size,
+                "maxBytes": self.maxBytes
+                }
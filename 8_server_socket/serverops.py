@@ -0,0 +1,17 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+
+from .abstractop import AbstractOp, PRIORITY_INTERACTIVE
+
+class SocketServerOps(AbstractOp):
+
+    def __init__(self, sockettaskview):
+        super().__init__(sockettaskview)
+        self.functions["getCacheStats"] = self.getCacheStats
+        self.threadSafe.update(["getCacheStats"])
+        self.priorities["getCacheStats"] = PRIORITY_INTERACTIVE
+
+    def getCacheStats(self,conn,jsonCall):
+        stats = self.parent.resultCache.getStats()
+        stats["poseFiles"] = self.parent.meshops.poseCache.getStats()
+        jsonCall.data = stats
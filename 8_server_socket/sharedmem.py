@@ -0,0 +1,77 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+
+"""
+Publishing of numpy arrays through named shared memory segments.
+
+When a client on the same machine asks for it, binary ops copy their array
+into a shared memory segment instead of sending it over the socket, and
+the response only describes where to find it. The client can then map the
+data with numpy without any further copies.
+
+Each kind of array (for example the body vertices, or the weights of one
+proxy) gets its own segment, which is reused by later calls as long as it
+is large enough. A segment's contents stay valid until the next call for the
+same kind of array. The generation number in the response increases every
+time a segment is rewritten.
+"""
+
+import itertools
+import os
+import threading
+
+import numpy as np
+
+try:
+    from multiprocessing import shared_memory
+except ImportError:
+    # Python < 3.8
+    shared_memory = None
+
+
+class SharedArrayStore():
+
+    def __init__(self):
+        self.segments = dict()
+        self.generation = itertools.count(1)
+        self.lock = threading.Lock()
+
+    def isAvailable(self):
+        return shared_memory is not None
+
+    def publish(self, key, array):
+        """Copy array into the segment for key and return a dict describing
+        it: segment name, dtype, shape, nbytes and generation."""
+        array = np.ascontiguousarray(array)
+        with self.lock:
+            segment = self.segments.get(key)
+            if segment is None or segment.size < array.nbytes:
+                if segment is not None:
+                    self._release(segment)
+                name = "mhsocket_" + str(os.getpid()) + "_" + str(next(self.generation))
+                segment = shared_memory.SharedMemory(name=name, create=True, size=max(array.nbytes, 1))
+                self.segments[key] = segment
+            target = np.ndarray(array.shape, dtype=array.dtype, buffer=segment.buf)
+            target[...] = array
+            del target
+            info = {
+                "sharedMemoryName": segment.name,
+                "dtype": array.dtype.str,
+                "shape": list(array.shape),
+                "nbytes": array.nbytes,
+                "generation": next(self.generation)
+                }
+        return info
+
+    def _release(self, segment):
+        segment.close()
+        try:
+            segment.unlink()
+        except FileNotFoundError:
+            pass
+
+    def close(self):
+        with self.lock:
+            for segment in self.segments.values():
+                self._release(segment)
+            self.segments = dict()
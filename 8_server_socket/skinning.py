@@ -0,0 +1,105 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+
+"""
+Linear blend skinning for getPosedCoordsBinary.
+
+The skin weights of a mesh are stored per influence slot: slot k holds the
+k-th strongest bone and weight of every vertex with more than k influences.
+Vertices are ordered by their number of influences, so each slot covers a
+prefix of them. Skinning blends the 3x4 skinning matrices of each vertex
+with one gather, multiply and add per slot, then applies the blended
+matrices to the rest coordinates. Nothing loops over bones or vertices in
+Python, and the weights only need to be prepared once per weights version.
+
+Only depends on numpy, so it can be benchmarked without MakeHuman.
+"""
+
+import numpy as np
+
+
+class SkinWeights():
+    """The skin weights of one mesh, prepared for skinCoords from one entry
+    per influence. bones are indices into the skinning matrices."""
+
+    def __init__(self, vertices, bones, weights):
+        vertices = np.asarray(vertices, dtype=np.intp)
+        bones = np.asarray(bones, dtype=np.intp)
+        weights = np.asarray(weights, dtype=np.float32)
+
+        # Group the influences by vertex, strongest first, and number them
+        order = np.lexsort((-weights, vertices))
+        vertices = vertices[order]
+        starts = np.flatnonzero(np.diff(vertices, prepend=-1))
+        counts = np.diff(np.append(starts, len(vertices)))
+        rank = np.arange(len(vertices)) - np.repeat(starts, counts)
+
+        # Vertices with the most influences first, so slot k is a prefix
+        byCount = np.argsort(-counts, kind='stable')
+        self.vertices = vertices[starts][byCount]
+        row = np.empty(len(starts), dtype=np.intp)
+        row[byCount] = np.arange(len(starts))
+        row = np.repeat(row, counts)
+
+        # Influences in slot order, and within a slot in vertex order
+        slotOrder = np.argsort(rank * len(starts) + row, kind='stable')
+        bones = bones[order][slotOrder]
+        weights = weights[order][slotOrder]
+        slotStarts = np.searchsorted(rank[slotOrder], np.arange(int(counts.max()) + 1 if len(counts) else 0))
+        self.slots = []
+        for start, end in zip(slotStarts[:-1], slotStarts[1:]):
+            self.slots.append((bones[start:end], weights[start:end, None]))
+
+
+def skinningMatrices(restGlobal, poseGlobal):
+    """Return the (numBones, 3, 4) float32 matrices that move vertices from
+    the rest pose to the pose, given the bones' global rest and pose
+    matrices as (numBones, 4, 4) arrays."""
+    matrices = np.matmul(poseGlobal, np.linalg.inv(restGlobal))
+    return np.ascontiguousarray(matrices[:, :3, :], dtype=np.float32)
+
+
+def posesToGlobal(restGlobal, parents, poses):
+    """Return the global pose matrices of bones posed with the local pose
+    matrices in poses, as stored in animation tracks. parents holds the
+    index of each bone's parent, or -1, and parents must come before their
+    children."""
+    poses = np.asarray(poses, dtype=np.float64)
+    if poses.shape[1] == 3:
+        poses = np.concatenate([poses, np.tile([[[0.0, 0.0, 0.0, 1.0]]], (len(poses), 1, 1))], axis=1)
+    poseGlobal = np.empty((len(parents), 4, 4))
+    for i, parent in enumerate(parents):
+        if parent < 0:
+            poseGlobal[i] = np.dot(restGlobal[i], poses[i])
+        else:
+            # Same as parent pose * rest relative to parent * local pose
+            relative = np.linalg.solve(restGlobal[parent], restGlobal[i])
+            poseGlobal[i] = np.dot(poseGlobal[parent], np.dot(relative, poses[i]))
+    return poseGlobal
+
+
+def skinCoords(restCoords, skinWeights, matrices):
+    """Return the float32 (numVertices, 3) coordinates of restCoords skinned
+    with the (numBones, 3, 4) matrices. Vertices without weights keep their
+    rest coordinates."""
+    restCoords = np.asarray(restCoords, dtype=np.float32)[:, :3]
+    posed = np.array(restCoords, dtype=np.float32)
+    numWeighted = len(skinWeights.vertices)
+    if not numWeighted:
+        return posed
+    matrices = np.ascontiguousarray(matrices, dtype=np.float32).reshape(-1, 12)
+    blended = np.zeros((numWeighted, 12), dtype=np.float32)
+    scratch = np.empty((numWeighted, 12), dtype=np.float32)
+    for bones, weights in skinWeights.slots:
+        n = len(bones)
+        np.take(matrices, bones, axis=0, out=scratch[:n])
+        scratch[:n] *= weights
+        blended[:n] += scratch[:n]
+
+    blended = blended.reshape(-1, 3, 4)
+    rest = restCoords[skinWeights.vertices]
+    result = blended[:, :, 3].copy()
+    for j in range(3):
+        result += blended[:, :, j] * rest[:, j, None]
+    posed[skinWeights.vertices] = result
+    return posed
@@ -27,6 +27,12 @@ import mh
 import gui
 import socket
 import json
+import os
+import selectors
+import stat
+import threading
+
+from concurrent import futures
 
 from core import G
 
@@ -46,75 +52,181 @@ QThread = mhapi.ui.QtCore.QThread
 from .dirops import SocketDirOps
 from .meshops import SocketMeshOps
 from .modops import SocketModifierOps
+from . import protocol
 
 class WorkerThread(QThread):
 
     signalAddMessage = qtSignal(str)
-    signalEvaluateCall = qtSignal()
 
-    def __init__(self, parent=None, socketConfig=None):
+    def __init__(self, parent=None, socketConfig=None, dispatcher=None):
         QThread.__init__(self, parent)
+        self.dispatcher = dispatcher
         self.exiting = False
         self.log = mhapi.utility.getLogChannel("socket")
         self.socketConfig = {'host' : '127.0.0.1',
-                             'port' : 12345}
+                             'port' : 12345,
+                             'tcp' : True,
+                             'unixSocketPath' : '',
+                             'keepAliveTimeout' : 30,
+                             'maxRequestSize' : 64 * 1024 * 1024}
         if socketConfig and isinstance(socketConfig, dict):
             self.socketConfig['host'] = socketConfig.get('host', '127.0.0.1')
             self.socketConfig['port'] = socketConfig.get('port', 12345)
+            self.socketConfig['tcp'] = socketConfig.get('tcp', True)
+            self.socketConfig['unixSocketPath'] = socketConfig.get('unixSocketPath', '')
+            self.socketConfig['keepAliveTimeout'] = socketConfig.get('keepAliveTimeout', 30)
+            self.socketConfig['maxRequestSize'] = socketConfig.get('maxRequestSize', 64 * 1024 * 1024)
+        self.sockets = []
 
     def addMessage(self,message,newLine = True):
         self.signalAddMessage.emit(message)
         pass
 
+    def openTcpSocket(self):
+        tcpSocket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        try:
+            tcpSocket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+            tcpSocket.bind((self.socketConfig.get('host'), self.socketConfig.get('port')))
+        except socket.error as msg:
+            tcpSocket.close()
+            self.addMessage('Bind failed. Error: ' + str(msg) + "\n")
+            return None
+        self.addMessage("Opened on host {0}\nOpened at port {1}\n".format(self.socketConfig.get('host'), self.socketConfig.get('port')))
+        return tcpSocket
+
+    def openUnixSocket(self):
+        path = self.socketConfig.get('unixSocketPath')
+        if not hasattr(socket, 'AF_UNIX'):
+            self.addMessage("Unix domain sockets are not supported on this platform\n")
+            return None
+        if os.path.exists(path) and stat.S_ISSOCK(os.stat(path).st_mode):
+            # Left behind by a previous run that did not shut down cleanly
+            os.unlink(path)
+        unixSocket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            unixSocket.bind(path)
+        except socket.error as msg:
+            unixSocket.close()
+            self.addMessage('Bind failed. Error: ' + str(msg) + "\n")
+            return None
+        self.addMessage("Opened at path {0}\n".format(path))
+        return unixSocket
+
     def run(self):
         self.addMessage("Opening server socket... ")        
-        self.socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
 
-        try:
-            self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
-            self.socket.bind((self.socketConfig.get('host'), self.socketConfig.get('port')))
-        except socket.error as msg:
-            self.addMessage('Bind failed. Error Code : ' + str(msg[0]) + ' Message ' + msg[1] + "\n")
+        if self.socketConfig.get('tcp'):
+            self.sockets.append(self.openTcpSocket())
+        if self.socketConfig.get('unixSocketPath'):
+            self.sockets.append(self.openUnixSocket())
+        self.sockets = [s for s in self.sockets if s is not None]
+
+        if not self.sockets:
             return
 
-        self.addMessage("Opened on host {0}\nOpened at port {1}\n".format(self.socketConfig.get('host'), self.socketConfig.get('port')))
+        selector = selectors.DefaultSelector()
+        for listener in self.sockets:
+            listener.listen(10)
+            selector.register(listener, selectors.EVENT_READ)
 
-        self.socket.listen(10)
+        self.addMessage("Waiting for connection.")        
 
         while not self.exiting:
-            self.addMessage("Waiting for connection.")        
-
             try:
-                conn, addr = self.socket.accept()
-    
-                if conn and not self.exiting:
-                    self.addMessage("Connected with " + str(addr[0]) + ":" + str(addr[1]))
-                    l = int.from_bytes(conn.recv(4), "big")
-                    data = b''
-                    while len(data) < l:
-                        data += conn.recv(8192)
-                    self.addMessage("Client says: '" + str(data, encoding='utf-8') + "'")
-                    data = gui3d.app.mhapi.internals.JsonCall(data)
-    
-                    self.jsonCall = data
-                    self.currentConnection = conn
-    
-                    self.signalEvaluateCall.emit()
-            except socket.error:
+                for key, mask in selector.select(timeout=0.5):
+                    conn, addr = key.fileobj.accept()
+        
+                    if conn and not self.exiting:
+                        if conn.family == socket.AF_INET:
+                            self.addMessage("Connected with " + str(addr[0]) + ":" + str(addr[1]))
+                        else:
+                            self.addMessage("Connected on " + self.socketConfig.get('unixSocketPath'))
+                        # Each client gets its own reader thread, so a client waiting
+                        # for a slow call does not keep others from being queued.
+                        thread = threading.Thread(target=self.serveConnection, args=(conn,))
+                        thread.daemon = True
+                        thread.start()
+            except (socket.error, ValueError):
                 """Assume this is because we closed the socket from outside"""
                 pass
 
+        selector.close()
+
+    def serveConnection(self, conn):
+        """Evaluate requests from conn until the client closes it. A client that
+        did not ask for keep-alive gets exactly one request evaluated."""
+        try:
+            while not self.exiting:
+                data = protocol.readRequest(conn, self.socketConfig.get('maxRequestSize'))
+                if data is None:
+                    break
+                size = len(data)
+                data = gui3d.app.mhapi.internals.JsonCall(data)
+                self.addMessage("Client called '" + str(data.getFunction()) + "' (" + str(size) + " bytes)")
+                keepAlive = protocol.isKeepAlive(data)
+
+                call = self.dispatcher.submit(conn, data)
+                if not self.waitForCall(call):
+                    return
+
+                if not keepAlive:
+                    break
+                conn.settimeout(self.socketConfig.get('keepAliveTimeout'))
+        except socket.timeout:
+            self.addMessage("Closing idle keep-alive connection")
+        except protocol.RequestError as e:
+            self.addMessage("Rejected request: " + str(e))
+            self.rejectRequest(conn, str(e))
+        except (ValueError, KeyError) as e:
+            self.addMessage("Malformed request: " + str(e))
+            self.rejectRequest(conn, "Malformed request: " + str(e))
+        except socket.error as e:
+            self.addMessage("Connection failed: " + str(e))
+        finally:
+            conn.close()
+
+    def rejectRequest(self, conn, message):
+        """Answer a request that could not be read with an error, as far as
+        the connection still allows it."""
+        jsonCall = gui3d.app.mhapi.internals.JsonCall()
+        jsonCall.setError(message)
+        try:
+            protocol.sendResponse(conn, jsonCall, bytes(jsonCall.serialize(), encoding='utf-8'))
+        except socket.error:
+            pass
+
+    def waitForCall(self, call):
+        """Block until call has been evaluated and its response sent. Returns
+        False if the connection should not be used any more."""
+        while True:
+            try:
+                call.future.result(timeout=0.5)
+                return True
+            except futures.TimeoutError:
+                if self.exiting:
+                    return False
+            except socket.error as e:
+                self.addMessage("Could not send response: " + str(e))
+                return False
+            except Exception as e:
+                self.addMessage("Call failed: " + str(e))
+                return False
+
     def stopListening(self):
         if not self.exiting:
             self.addMessage("Stopping socket connection")
             self.exiting = True
-            try:
-                self.socket.shutdown(socket.SHUT_RDWR)
-            except socket.error:
-                """If the socket was not connected, shutdown will complain. This isn't a problem, 
-                so just ignore."""
-                pass
-            self.socket.close()
+            for listener in self.sockets:
+                try:
+                    listener.shutdown(socket.SHUT_RDWR)
+                except socket.error:
+                    """If the socket was not connected, shutdown will complain. This isn't a problem, 
+                    so just ignore."""
+                    pass
+                listener.close()
+            path = self.socketConfig.get('unixSocketPath')
+            if path and os.path.exists(path) and stat.S_ISSOCK(os.stat(path).st_mode):
+                os.unlink(path)
 
     def __del__(self):        
         self.stopListening()
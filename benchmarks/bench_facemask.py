@@ -0,0 +1,95 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+
+"""
+Benchmark of the face mask encodings used by getBodyMeshInfo and
+getProxiesInfo.
+
+Compares the per-element loop the socket plugin used to run with the numpy
+run-length encoder in facemask.py, and checks that both give identical run
+lists. Also times np.packbits, which getBodyFaceMaskBinary sends instead.
+Uses synthetic masks the size of the body mesh, with and without a helper
+mesh hiding large regions:
+
+    python3 benchmarks/bench_facemask.py [--repeat N]
+"""
+
+import argparse
+import importlib.util
+import os
+import time
+
+import numpy as np
+
+# Face count of the hm08 base mesh, including the helper geometry
+NUM_FACES = 18528
+
+
+def loopRunLengthIdx(boolArray):
+    # The encoder as it was before it was vectorized
+    out = []
+    i = 0
+    needNewRun = True
+
+    while i < len(boolArray):
+        if boolArray[i]:
+            if needNewRun:
+                out.append([i,i])
+                needNewRun = False
+            out[ len(out) - 1 ][1] = i
+        else:
+            needNewRun = True
+        i = i + 1
+
+    return out
+
+
+def loadFaceMaskModule():
+    path = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "8_server_socket", "facemask.py")
+    spec = importlib.util.spec_from_file_location("facemask", path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def best(function, arg, repeat):
+    times = []
+    for i in range(repeat):
+        start = time.perf_counter()
+        result = function(arg)
+        times.append(time.perf_counter() - start)
+    return (min(times), result)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark face mask encodings")
+    parser.add_argument("--repeat", type=int, default=5, help="Runs per case, the best is reported")
+    args = parser.parse_args()
+
+    facemask = loadFaceMaskModule()
+    rng = np.random.default_rng(0)
+    helperHidden = np.ones(NUM_FACES, dtype=bool)
+    helperHidden[13000:] = False
+    for start in rng.integers(0, 13000, 40):
+        helperHidden[start:start + rng.integers(10, 200)] = False
+    cases = [
+        ("all visible", np.ones(NUM_FACES, dtype=bool)),
+        ("helper hidden", helperHidden),
+        ("random", rng.random(NUM_FACES) > 0.5),
+        ("empty", np.zeros(0, dtype=bool))
+        ]
+
+    for name, mask in cases:
+        slow, expected = best(loopRunLengthIdx, mask, args.repeat)
+        fast, actual = best(facemask.boolsToRunLengthIdx, mask, args.repeat)
+        if actual != expected:
+            raise SystemExit("Run lists differ for " + name)
+        packed, bits = best(np.packbits, mask, args.repeat)
+        if not np.array_equal(np.unpackbits(bits, count=len(mask)).astype(bool), mask):
+            raise SystemExit("Packed mask differs for " + name)
+        print("%-14s %6d runs  loop %8.3f ms  numpy %7.3f ms  packbits %7.3f ms (%d bytes)" % (
+            name, len(actual), slow * 1000, fast * 1000, packed * 1000, bits.nbytes))
+
+
+if __name__ == "__main__":
+    main()
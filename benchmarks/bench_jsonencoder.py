@@ -0,0 +1,84 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+
+"""
+Benchmark of the JSON encoder used for socket responses.
+
+Encodes synthetic getCoord responses the size of the default body mesh and
+of the subdivided body mesh, once with the numeric fast path and once
+value by value, and checks that both give the same text. The encoder only
+depends on numpy, so this runs without MakeHuman:
+
+    python3 benchmarks/bench_jsonencoder.py [--repeat N]
+"""
+
+import argparse
+import importlib.util
+import os
+import time
+
+import numpy as np
+
+# Vertex counts of the hm08 base mesh, without and with subdivision
+MESHES = [("default mesh", 13380), ("subdivided mesh", 53104)]
+
+
+def loadEncoderModule():
+    path = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "8_server_socket", "jsonencoder.py")
+    spec = importlib.util.spec_from_file_location("jsonencoder", path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+class FakeCall():
+
+    def __init__(self, function, data):
+        self.function = function
+        self.params = {}
+        self.data = data
+
+    def getFunction(self):
+        return self.function
+
+    def getError(self):
+        return ""
+
+    def getData(self):
+        return self.data
+
+
+def timeEncode(encoder, call, repeat):
+    best = None
+    for i in range(repeat):
+        start = time.perf_counter()
+        text = encoder.encode(call)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return (best, text)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the JSON response encoder")
+    parser.add_argument("--repeat", type=int, default=3, help="Runs per case, the best is reported")
+    args = parser.parse_args()
+
+    jsonencoder = loadEncoderModule()
+    vectorized = jsonencoder.JsonEncoder()
+    scalar = jsonencoder.JsonEncoder(vectorize=False)
+
+    rng = np.random.default_rng(0)
+    for name, numVerts in MESHES:
+        coord = rng.uniform(-10.0, 10.0, (numVerts, 3)).astype(np.float32)
+        for label, data in (("ndarray", coord), ("nested list", coord.tolist())):
+            call = FakeCall("getCoord", data)
+            slow, expected = timeEncode(scalar, call, args.repeat)
+            fast, actual = timeEncode(vectorized, call, args.repeat)
+            if actual != expected:
+                raise SystemExit("Output differs for " + name + " (" + label + ")")
+            print("getCoord, %-16s %-12s %7d verts  %8.1f ms -> %7.1f ms  (%.1fx, %d bytes)" % (
+                name, label, numVerts, slow * 1000, fast * 1000, slow / fast, len(actual)))
+
+
+if __name__ == "__main__":
+    main()
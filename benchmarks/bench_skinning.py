@@ -0,0 +1,122 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+
+"""
+Benchmark of getPosedCoordsBinary against skinning on the client.
+
+Without getPosedCoordsBinary, a client fetches the rest coordinates, the
+skin weights (getBodySkinWeightsCSR) and the bone matrices, and skins the
+mesh itself, typically one bone at a time. This compares that loop with the
+sparse skinning in skinning.py, on synthetic data the size of the body mesh
+and default skeleton, checks that both give the same coordinates, and
+prints how many bytes each way has to transfer. Only depends on numpy:
+
+    python3 benchmarks/bench_skinning.py [--repeat N]
+"""
+
+import argparse
+import importlib.util
+import os
+import time
+
+import numpy as np
+
+# Vertex count of the hm08 base mesh, including the helper geometry, and
+# bone count of the default skeleton
+NUM_VERTICES = 19158
+NUM_BONES = 163
+MAX_INFLUENCES_PER_VERTEX = 4
+
+
+def loadSkinningModule():
+    path = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "8_server_socket", "skinning.py")
+    spec = importlib.util.spec_from_file_location("skinning", path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def makeWeights(rng):
+    """Return CSR skin weights as getBodySkinWeightsCSR sends them. Like in
+    real weights, vertices have different numbers of influences, some none
+    at all, and no bone twice."""
+    counts = rng.integers(0, MAX_INFLUENCES_PER_VERTEX + 1, NUM_VERTICES)
+    vertices = np.repeat(np.arange(NUM_VERTICES), counts)
+    ranks = np.argsort(rng.random((NUM_VERTICES, NUM_BONES)), axis=1)[:, :MAX_INFLUENCES_PER_VERTEX]
+    bones = ranks[np.arange(MAX_INFLUENCES_PER_VERTEX) < counts[:, None]]
+    weights = rng.random(len(vertices)).astype(np.float32)
+    weights /= np.bincount(vertices, weights)[vertices].astype(np.float32)
+    order = np.argsort(bones, kind='stable')
+    boneOffsets = np.zeros(NUM_BONES + 1, dtype=np.uint32)
+    boneOffsets[1:] = np.cumsum(np.bincount(bones, minlength=NUM_BONES))
+    return (boneOffsets, vertices[order].astype(np.uint32), weights[order])
+
+
+def makeMatrices(rng):
+    matrices = np.zeros((NUM_BONES, 4, 4))
+    for i in range(NUM_BONES):
+        q, r = np.linalg.qr(rng.standard_normal((3, 3)))
+        matrices[i, :3, :3] = q
+        matrices[i, :3, 3] = rng.standard_normal(3)
+        matrices[i, 3, 3] = 1.0
+    return matrices
+
+
+def clientSideSkin(rest, boneOffsets, vertices, weights, matrices):
+    # What a client has to do with the CSR weights, one bone at a time.
+    # Vertices without weights stay at rest.
+    posed = np.zeros_like(rest)
+    unweighted = np.bincount(vertices, minlength=len(rest)) == 0
+    posed[unweighted] = rest[unweighted]
+    for i in range(len(matrices)):
+        start, end = boneOffsets[i], boneOffsets[i + 1]
+        if start == end:
+            continue
+        indices = vertices[start:end]
+        transformed = np.dot(rest[indices], matrices[i, :3, :3].T) + matrices[i, :3, 3]
+        posed[indices] += weights[start:end, None] * transformed
+    return posed
+
+
+def best(function, repeat):
+    times = []
+    for i in range(repeat):
+        start = time.perf_counter()
+        result = function()
+        times.append(time.perf_counter() - start)
+    return (min(times), result)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark server-side skinning")
+    parser.add_argument("--repeat", type=int, default=5, help="Runs per case, the best is reported")
+    args = parser.parse_args()
+
+    skinning = loadSkinningModule()
+    rng = np.random.default_rng(0)
+    rest = rng.random((NUM_VERTICES, 3)).astype(np.float32)
+    boneOffsets, vertices, weights = makeWeights(rng)
+    restGlobal = makeMatrices(rng)
+    poseGlobal = np.matmul(makeMatrices(rng), restGlobal)
+    bones = np.repeat(np.arange(NUM_BONES), np.diff(boneOffsets))
+
+    matrices = skinning.skinningMatrices(restGlobal, poseGlobal)
+    clientTime, expected = best(lambda: clientSideSkin(rest, boneOffsets, vertices, weights, matrices), args.repeat)
+    prepareTime, skinWeights = best(lambda: skinning.SkinWeights(vertices, bones, weights), args.repeat)
+    matricesTime, matrices = best(lambda: skinning.skinningMatrices(restGlobal, poseGlobal), args.repeat)
+    serverTime, actual = best(lambda: skinning.skinCoords(rest, skinWeights, matrices), args.repeat)
+    error = np.abs(actual - expected).max()
+    if error > 1e-4:
+        raise SystemExit("Skinned coordinates differ by " + str(error))
+
+    clientBytes = rest.nbytes + boneOffsets.nbytes + vertices.nbytes + weights.nbytes + NUM_BONES * 16 * 4
+    print("%d vertices, %d bones, %d influences" % (NUM_VERTICES, NUM_BONES, len(vertices)))
+    print("client, per-bone loop   %8.3f ms  %9d bytes fetched" % (clientTime * 1000, clientBytes))
+    print("server, skinCoords      %8.3f ms  %9d bytes fetched" % (serverTime * 1000, actual.nbytes))
+    print("  once per weights version: SkinWeights %.3f ms" % (prepareTime * 1000))
+    print("  once per pose version: skinningMatrices %.3f ms" % (matricesTime * 1000))
+    print("max difference %.2e" % error)
+
+
+if __name__ == "__main__":
+    main()
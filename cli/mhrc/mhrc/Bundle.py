@@ -0,0 +1,40 @@
+#!/usr/bin/python
+
+import json
+import struct
+
+import numpy
+
+# Decoding of the multi-section binary responses returned by, for example,
+# the "batch" function. See 8_server_socket/bundle.py for the layout.
+
+BUNDLE_MAGIC = b"MHBN"
+BUNDLE_PREFIX = struct.Struct("!4sHHI")
+
+
+def parseBundle(payload):
+    """Return a list of (section, data) tuples, where section is the dict
+    describing the section and data is a memoryview of its payload."""
+    view = memoryview(payload)
+    magic, version, reserved, headerLength = BUNDLE_PREFIX.unpack_from(view)
+    if magic != BUNDLE_MAGIC:
+        raise ValueError("Payload is not a bundle")
+    start = BUNDLE_PREFIX.size
+    header = json.loads(bytes(view[start:start + headerLength]).decode('utf-8'))
+    out = []
+    for section in header["sections"]:
+        offset = section["offset"]
+        out.append((section, view[offset:offset + section["length"]]))
+    return out
+
+
+def bundleArrays(payload):
+    """Return a dict mapping the name of each array section (those with a
+    dtype and shape, as in getBodyMeshBundle) to a numpy array viewing the
+    payload. The arrays are not copied and are read-only if payload is."""
+    out = {}
+    for section, data in parseBundle(payload):
+        if "dtype" in section:
+            array = numpy.frombuffer(data, dtype=section["dtype"])
+            out[section["name"]] = array.reshape(section["shape"])
+    return out
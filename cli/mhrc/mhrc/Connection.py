@@ -0,0 +1,160 @@
+#!/usr/bin/python
+
+import lzma
+import socket
+import struct
+import zlib
+
+try:
+    import lz4.frame
+except ImportError:
+    lz4 = None
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+from .JsonCall import JsonCall
+
+# A persistent connection to the socket server. Each call is sent with the
+# "keepAlive" and "responseHeader" params set, so the server precedes every
+# response with a header giving its length, content type and error flag,
+# and leaves the connection open for the next call.
+#
+# If compression is given (a codec name such as "zlib", or a list of them in
+# order of preference), it is sent as the "compression" param of every call,
+# and compressed responses are decompressed before they are returned.
+
+RESPONSE_MAGIC = b"MHRS"
+RESPONSE_HEADER = struct.Struct("!4sBBBBQ")
+# Version 2 headers are followed by the etag of the result
+RESPONSE_ETAG = struct.Struct("!Q")
+
+CONTENT_JSON = 0
+CONTENT_BINARY = 1
+
+FLAG_ERROR = 0x01
+FLAG_NOT_MODIFIED = 0x02
+FLAG_STREAM = 0x04
+
+CODEC_NONE = 0
+CODEC_ZLIB = 1
+CODEC_LZMA = 2
+CODEC_LZ4 = 3
+CODEC_ZSTD = 4
+
+def _decompress(codec, payload):
+    if codec == CODEC_ZLIB:
+        return bytearray(zlib.decompress(payload))
+    if codec == CODEC_LZMA:
+        return bytearray(lzma.decompress(payload))
+    if codec == CODEC_LZ4 and lz4 is not None:
+        return bytearray(lz4.frame.decompress(payload))
+    if codec == CODEC_ZSTD and zstandard is not None:
+        return bytearray(zstandard.ZstdDecompressor().decompressobj().decompress(payload))
+    raise IOError("Response uses unsupported codec " + str(codec))
+
+class Connection():
+
+
+    def __init__(self, host = "127.0.0.1", port = 12345, path = None, compression = None):
+        self.compression = compression
+        # The etag of the last response, 0 if it had none
+        self.lastEtag = 0
+        # If path is given, connect to the server's unix domain socket
+        # at that path instead of over TCP
+        if path:
+            self.client = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            self.client.connect(path)
+        else:
+            self.client = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            self.client.connect((host, port))
+
+
+    def __enter__(self):
+        return self
+
+
+    def __exit__(self, *args):
+        self.close()
+
+
+    def _recvExactly(self, size):
+        data = bytearray(size)
+        view = memoryview(data)
+        pos = 0
+        while pos < size:
+            n = self.client.recv_into(view[pos:], size - pos)
+            if n == 0:
+                raise IOError("Connection closed by server")
+            pos = pos + n
+        return data
+
+
+    def _recvHeader(self):
+        magic, version, contentType, flags, codec, length = RESPONSE_HEADER.unpack(self._recvExactly(RESPONSE_HEADER.size))
+        if magic != RESPONSE_MAGIC:
+            raise IOError("Response does not start with a valid header")
+        etag = 0
+        if version >= 2:
+            etag, = RESPONSE_ETAG.unpack(self._recvExactly(RESPONSE_ETAG.size))
+        return (contentType, flags, codec, length, etag)
+
+
+    def _send(self, jsonCall):
+        jsonCall.setParam("keepAlive", 1)
+        jsonCall.setParam("responseHeader", 2)
+        if self.compression:
+            jsonCall.setParam("compression", self.compression)
+        data = bytes(jsonCall.serialize(), 'utf-8')
+        self.client.sendall(len(data).to_bytes(4, 'big') + data)
+
+
+    def _recvResponse(self):
+        contentType, flags, codec, length, self.lastEtag = self._recvHeader()
+        payload = self._recvExactly(length)
+        if codec != CODEC_NONE:
+            payload = _decompress(codec, payload)
+        return (contentType, flags, payload)
+
+
+    def callRaw(self, jsonCall):
+        """Send jsonCall and return (contentType, flags, payload). The payload
+        is received into a single preallocated bytearray."""
+        self._send(jsonCall)
+        return self._recvResponse()
+
+
+    def callStream(self, jsonCall):
+        """Send a streaming call such as streamAnimation and yield
+        (contentType, flags, payload) for each of its responses, up to and
+        including the final one, which has no FLAG_STREAM. The server only
+        produces responses as fast as they are read here."""
+        self._send(jsonCall)
+        while True:
+            response = self._recvResponse()
+            yield response
+            if not response[1] & FLAG_STREAM:
+                return
+
+
+    def call(self, jsonCall):
+        """Send jsonCall and return the response as a JsonCall. For binary
+        responses, the data of the returned JsonCall is the raw bytearray,
+        and its "etag" param is set if the function reported one."""
+        contentType, flags, payload = self.callRaw(jsonCall)
+        if contentType == CONTENT_BINARY:
+            response = JsonCall()
+            response.setFunction(jsonCall.getFunction())
+            response.setData(payload)
+            if self.lastEtag:
+                response.setParam("etag", self.lastEtag)
+            return response
+        return JsonCall(payload.decode('utf-8'))
+
+
+    def close(self):
+        if self.client:
+            self.client.close()
+            self.client = None
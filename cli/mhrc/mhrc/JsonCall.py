@@ -16,6 +16,8 @@ import numpy
 # makehuman data types (the encoding routine will croak on anything
 # that isn't scalar, array or dict)
 
+_NUM_FORMAT = re.compile(r"^[\-]?[0-9][0-9]*\.?[0-9]+$")
+
 class JsonCall():
 
 
@@ -85,7 +87,7 @@ class JsonCall():
         if isinstance(val,str):
             return "string"
 
-        if val == None:
+        if val is None:
             return "none"
 
         if self._isDict(val):
@@ -109,30 +111,28 @@ class JsonCall():
 
 
     def _isNumeric(self,val):
-        if val == None:
+        if val is None:
             return False
-        if isinstance(val,int):
-            return True
-        if isinstance(val,float):
-            return True
-        if isinstance(val,numpy.float32):
-            return True
-        if isinstance(val,numpy.float64):
+        if isinstance(val,(int,float,numpy.integer,numpy.floating)):
             return True
-        num_format = re.compile("^[\-]?[0-9][0-9]*\.?[0-9]+$")
-        isnumber = re.match(num_format,str(val))
-        return isnumber
+        return _NUM_FORMAT.match(str(val)) is not None
 
 
     def _numberAsString(self,val):
+        if isinstance(val,(bool,numpy.bool_)):
+            return "true" if val else "false"
         if isinstance(val,float):
             return "{0:.8f}".format(val)
         else:
             return str(val)
 
 
-    def _dictAsString(self,val):
-        ret = "{ "
+    # The _append* methods add the pieces of the encoded value to the list
+    # out, which is joined once at the end. This keeps encoding linear in the
+    # size of the output.
+
+    def _appendDict(self,out,val):
+        out.append("{ ")
 
         first = True
 
@@ -140,88 +140,112 @@ class JsonCall():
             if first:
                 first = False
             else:
-                ret = ret + ", "
-            ret = ret + self.pythonValueToJsonValue(val[key],key)
+                out.append(", ")
+            self._appendJsonValue(out,val[key],key)
 
-        return ret + " }"
+        out.append(" }")
 
 
-    def _arrayAsString(self,array):
-        ret = "[ "
+    def _appendArray(self,out,array):
+        out.append("[ ")
         n = len(array)
         for i in range(n):
-            val = array[i]
-            ret = ret + self.pythonValueToJsonValue(val)
+            self._appendJsonValue(out,array[i])
             if i + 1 < n:
-                ret += ","
-        return ret + " ]"
+                out.append(",")
+        out.append(" ]")
 
 
-    def pythonValueToJsonValue(self,val,keyName = None):
+    def _appendJsonValue(self,out,val,keyName = None):
 
-        out = ""
+        if keyName is not None:
+            out.append("\"" + str(keyName) + "\": ")
 
-        if keyName:
-            out = "\"" + keyName + "\": "
+        if isinstance(val,(bool,numpy.bool_)):
+            out.append(self._numberAsString(val))
+            return
 
         vType = self._guessValueType(val)
 
-        if val == None:
-            return out + "null"
+        if vType == "none":
+            out.append("null")
+        elif vType == "string":
+            if isinstance(val,bytes):
+                val = val.decode('utf-8')
+            out.append("\"" + val.replace("\"","\\\"") + "\"")
+        elif vType == "dict":
+            self._appendDict(out,val)
+        elif vType == "array":
+            self._appendArray(out,val)
+        else:
+            out.append(self._numberAsString(val))
 
-        if vType == "string":
-            return out + "\"" + val.replace("\"","\\\"") + "\""
 
-        if vType == "dict":
-            return out + self._dictAsString(val)
+    def _dictAsString(self,val):
+        out = []
+        self._appendDict(out,val)
+        return "".join(out)
 
-        if vType == "array":
-            return out + self._arrayAsString(val)
 
-        if vType == "numeric":
-            return out + self._numberAsString(val)
+    def _arrayAsString(self,array):
+        out = []
+        self._appendArray(out,array)
+        return "".join(out)
 
-        return out + "\"" + str(val) + "\""
+
+    def pythonValueToJsonValue(self,val,keyName = None):
+        out = []
+        self._appendJsonValue(out,val,keyName)
+        return "".join(out)
 
 
     def serialize(self):
-        ret = "{\n";
-        ret = ret + "  \"function\": \"" + self.function + "\",\n"
-        ret = ret + "  \"error\": \"" + self.error + "\",\n"
-        ret = ret + "  \"params\": {\n"
+        out = ["{\n"]
+        out.append("  \"function\": \"" + self.function + "\",\n")
+        out.append("  \"error\": \"" + self.error + "\",\n")
+        out.append("  \"params\": {\n")
 
         first = True
 
         for key in self.params.keys():
             if not first:
-                ret = ret + ",\n"
+                out.append(",\n")
             else:
                 first = False
-            ret = ret + "    " + self.pythonValueToJsonValue(self.params[key],key) 
+            out.append("    ")
+            self._appendJsonValue(out,self.params[key],key)
 
-        ret = ret + "\n  },\n"
+        out.append("\n  },\n")
 
-        ret = ret + "  " + self.pythonValueToJsonValue(self.data,"data") + "\n}\n"
+        out.append("  ")
+        self._appendJsonValue(out,self.data,"data")
+        out.append("\n}\n")
 
-        return ret
+        return "".join(out)
 
 
-    def send(self, host = "127.0.0.1", port = 12345):
-        client = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        client.connect((host, port))
-        data = self.serialize()
-        client.send(len(data).to_bytes(4, 'big'))
-        client.send(bytes(data, 'utf-8'))
+    def send(self, host = "127.0.0.1", port = 12345, path = None):
+        if path:
+            client = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            client.connect(path)
+        else:
+            client = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            client.connect((host, port))
+        data = bytes(self.serialize(), 'utf-8')
+        client.sendall(len(data).to_bytes(4, 'big') + data)
+
+        chunks = []
 
-        data = ""
-    
         while True:
-            buf = client.recv(1024)
+            buf = client.recv(65536)
             if len(buf) > 0:
-                data += buf.strip().decode('utf-8')
+                chunks.append(buf)
             else:
                 break
-    
+
+        client.close()
+        data = b''.join(chunks).strip().decode('utf-8')
+
         if data:
             return JsonCall(data)
         else:            
@@ -1,5 +1,5 @@
 #!/usr/bin/python
 
-__all__ = ["JsonCall"]
+__all__ = ["JsonCall", "Connection", "Bundle"]
 
 